@@ -1,13 +1,44 @@
+from functools import partial
+
 from django.contrib import admin
+from django.core.cache import cache
+from django.db import transaction
+
+from . import cart, models, search, tasks
+from .counters import recount
+from .images import make_thumbnails
+from .user_state import state_key
+
 
-from . import models
+class IngredientRecipeInline(admin.TabularInline):
+    model = models.IngredientRecipe
+    fields = ('ingredient', 'amount')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(models.Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author')
+    list_display = ('name', 'author', 'favorites_count')
     list_filter = ('author', 'name', 'tags')
     search_fields = ('author__username', 'author__email', 'name')
+    readonly_fields = ('favorites_count', 'shopping_cart_count')
+    inlines = (IngredientRecipeInline,)
+
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            obj.has_thumbnails = False
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            tasks.submit(make_thumbnails, obj.image.name)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        search.update_search_vector([form.instance.pk])
 
 
 @admin.register(models.Ingredient)
@@ -16,7 +47,53 @@ class IngredientAdmin(admin.ModelAdmin):
     list_filter = ('name', )
 
 
+class UserRecipeAdmin(admin.ModelAdmin):
+    """Связи пользователя с рецептами: только просмотр и удаление.
+
+    Удаление пересчитывает счётчик рецептов и сбрасывает кэш
+    пользователя, как при удалении через API.
+    """
+    list_display = ('user', 'recipe')
+    counter = None
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, self.model.objects.filter(pk=obj.pk))
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        removed = {}
+        for user_id, recipe_id in queryset.values_list('user', 'recipe'):
+            removed.setdefault(user_id, []).append(recipe_id)
+        queryset.delete()
+        recount(models.Recipe, self.counter, self.model, 'recipe', pks={
+            recipe_id for recipe_ids in removed.values()
+            for recipe_id in recipe_ids
+        })
+        for user_id, recipe_ids in removed.items():
+            self.recipes_removed(user_id, recipe_ids)
+            transaction.on_commit(partial(cache.delete, state_key(user_id)))
+
+    def recipes_removed(self, user_id, recipe_ids):
+        pass
+
+
+@admin.register(models.FavoriteRecipe)
+class FavoriteRecipeAdmin(UserRecipeAdmin):
+    counter = 'favorites_count'
+
+
+@admin.register(models.ShoppingCart)
+class ShoppingCartAdmin(UserRecipeAdmin):
+    counter = 'shopping_cart_count'
+
+    def recipes_removed(self, user_id, recipe_ids):
+        cart.recipes_changed(user_id, recipe_ids)
+
+
 admin.site.register(models.Tag)
-admin.site.register(models.IngredientRecipe)
-admin.site.register(models.FavoriteRecipe)
-admin.site.register(models.ShoppingCart)
@@ -0,0 +1,97 @@
+from django.db import transaction
+
+from .counters import COUNTERS, recount
+
+# Итог для каждого id в ответе пакетного запроса.
+CREATED = 'created'
+EXISTS = 'exists'
+DELETED = 'deleted'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def counter_for(model, field):
+    for counter in COUNTERS:
+        if counter[2] is model and counter[3] == field:
+            return counter
+    raise LookupError(f'Нет счётчика для {model._meta.label}.{field}')
+
+
+def split_ids(user, model, field, ids):
+    """Разбивает ids на найденные объекты и уже связанные с user.
+
+    Стоит два запроса независимо от длины списка.
+    """
+    target = model._meta.get_field(field).related_model
+    found = set(
+        target.objects.filter(pk__in=ids).values_list('pk', flat=True)
+    )
+    existing = set(
+        model.objects.filter(
+            user=user,
+            **{f'{field}_id__in': found}
+        ).values_list(f'{field}_id', flat=True)
+    )
+    return found, existing
+
+
+def add_batch(user, model, field, ids, exclude=(), on_change=None):
+    """Создаёт связи user с объектами ids одним INSERT.
+
+    Возвращает итоги по каждому id и список созданных связей. on_change
+    вызывается в той же транзакции с id пользователя и созданными id.
+    Счётчики затронутых объектов пересчитываются одним UPDATE, поэтому
+    гонка с параллельным запросом не сбивает их.
+    """
+    with transaction.atomic():
+        found, existing = split_ids(user, model, field, ids)
+        created = [
+            pk for pk in ids
+            if pk in found and pk not in existing and pk not in exclude
+        ]
+        if created:
+            model.objects.bulk_create(
+                [model(user=user, **{f'{field}_id': pk}) for pk in created],
+                ignore_conflicts=True
+            )
+            recount(*counter_for(model, field), pks=created)
+            if on_change is not None:
+                on_change(user.pk, created)
+    outcomes = []
+    for pk in ids:
+        if pk not in found:
+            result = NOT_FOUND
+        elif pk in exclude:
+            result = FORBIDDEN
+        elif pk in existing:
+            result = EXISTS
+        else:
+            result = CREATED
+        outcomes.append({'id': pk, 'status': result})
+    return outcomes, created
+
+
+def remove_batch(user, model, field, ids, on_change=None):
+    """Удаляет связи user с объектами ids одним DELETE."""
+    with transaction.atomic():
+        found, existing = split_ids(user, model, field, ids)
+        deleted = [pk for pk in ids if pk in existing]
+        if deleted:
+            model.objects.filter(
+                user=user,
+                **{f'{field}_id__in': deleted}
+            ).delete()
+            recount(*counter_for(model, field), pks=deleted)
+            if on_change is not None:
+                on_change(user.pk, deleted)
+    outcomes = []
+    for pk in ids:
+        if pk not in found:
+            result = NOT_FOUND
+        elif pk in existing:
+            result = DELETED
+        else:
+            result = MISSING
+        outcomes.append({'id': pk, 'status': result})
+    return outcomes, deleted
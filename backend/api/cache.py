@@ -0,0 +1,70 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+
+def get_version(group):
+    """Время последнего изменения группы данных, общее для всех процессов."""
+    key = f'version:{group}'
+    version = cache.get(key)
+    if version is not None:
+        return version
+    version = time.time()
+    if cache.add(key, version, timeout=None):
+        return version
+    return cache.get(key, version)
+
+
+def bump_version(group):
+    version = time.time()
+    cache.set(f'version:{group}', version, timeout=None)
+    return version
+
+
+class CachedResponseMixin:
+    """Отдаёт list/retrieve из кэша готовым JSON с ETag и Last-Modified.
+
+    Ключ кэша включает версию группы `cache_group`, поэтому после
+    bump_version старые ответы просто перестают находиться.
+    """
+    cache_group = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return handler(request, *args, **kwargs)
+        version = get_version(self.cache_group)
+        key = 'response:' + hashlib.md5(
+            f'{self.cache_group}:{version}:{request.get_full_path()}'.encode()
+        ).hexdigest()
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = JSONRenderer().render(response.data)
+            cached = (body, quote_etag(hashlib.md5(body).hexdigest()))
+            cache.set(key, cached)
+        body, etag = cached
+        last_modified = int(version)
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified,
+            response=response
+        )
@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from users.models import User
+
+from .models import IngredientRecipe, ShoppingCart, ShoppingCartIngredient
+
+
+def cart_totals(user_ids=None, ingredient_ids=None):
+    """Суммы ингредиентов по спискам покупок, посчитанные по рецептам."""
+    rows = IngredientRecipe.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(recipe__recipe_cart__user__in=user_ids)
+    else:
+        rows = rows.filter(recipe__recipe_cart__isnull=False)
+    if ingredient_ids is not None:
+        rows = rows.filter(ingredient_id__in=ingredient_ids)
+    return rows.order_by().values_list(
+        'recipe__recipe_cart__user', 'ingredient'
+    ).annotate(total=Sum('amount'))
+
+
+@transaction.atomic
+def refresh(user_ids, ingredient_ids):
+    """Пересчитывает строки (пользователь, ингредиент) из списков покупок.
+
+    Трогает только переданные пары, поэтому дешевле полного пересчёта.
+    Строки пользователей блокируются, и последняя из параллельных
+    транзакций пересчитывает суммы с учётом изменений всех остальных.
+    """
+    user_ids = sorted(set(user_ids))
+    ingredient_ids = set(ingredient_ids)
+    if not user_ids or not ingredient_ids:
+        return
+    list(User.objects.select_for_update().filter(
+        pk__in=user_ids
+    ).order_by('pk').values_list('pk', flat=True))
+    totals = cart_totals(user_ids, ingredient_ids)
+    ShoppingCartIngredient.objects.filter(
+        user_id__in=user_ids,
+        ingredient_id__in=ingredient_ids
+    ).delete()
+    ShoppingCartIngredient.objects.bulk_create([
+        ShoppingCartIngredient(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            amount=total
+        )
+        for user_id, ingredient_id, total in totals
+    ])
+
+
+def recipes_ingredients(recipe_ids):
+    return set(IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredient_id', flat=True))
+
+
+def cart_users(recipe_id):
+    return list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True))
+
+
+def recipes_changed(user_id, recipe_ids):
+    """Рецепты добавлены в список покупок пользователя или удалены из него."""
+    refresh([user_id], recipes_ingredients(recipe_ids))
+
+
+def recipe_ingredients_changed(recipe, ingredient_ids):
+    """У рецепта изменились ингредиенты или их количество."""
+    refresh(cart_users(recipe.pk), ingredient_ids)
+
+
+def user_cart(user):
+    return ShoppingCartIngredient.objects.filter(user=user).values(
+        'amount',
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit')
+    ).order_by('ingredient__name')
+
+
+def drift():
+    """Пары (пользователь, ингредиент), где таблица разошлась с рецептами."""
+    expected = {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in cart_totals().iterator()
+    }
+    actual = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in
+        ShoppingCartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'amount'
+        ).iterator()
+    }
+    return {
+        key for key in expected.keys() | actual.keys()
+        if expected.get(key) != actual.get(key)
+    }
+
+
+@transaction.atomic
+def rebuild(batch_size=1000):
+    ShoppingCartIngredient.objects.all().delete()
+    ShoppingCartIngredient.objects.bulk_create(
+        (
+            ShoppingCartIngredient(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                amount=total
+            )
+            for user_id, ingredient_id, total in cart_totals().iterator()
+        ),
+        batch_size=batch_size
+    )
@@ -0,0 +1,159 @@
+import bisect
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_version
+from .models import IngredientRecipe
+
+VERSION_GROUP = 'recipe_ingredients'
+
+
+class CookableIndex:
+    """Инвертированный индекс ингредиент -> рецепты в памяти процесса.
+
+    Для каждого ингредиента хранится отсортированный array('I') с id
+    рецептов, для каждого рецепта - набор его ингредиентов.
+
+    Изменённые рецепты записываются в общий журнал в кэше под номерами
+    от атомарного счётчика. Каждый процесс перечитывает из базы
+    ингредиенты только рецептов из журнала после своей позиции. Полная
+    перестройка нужна при смене версии группы 'recipe_ingredients'
+    (удаление ингредиента), а также если журнал отстал больше чем на
+    MAX_CHANGES записей или его записи вытеснены из кэша, и не реже чем
+    раз в INDEX_MAX_AGE секунд - на случай потерянной записи журнала.
+    """
+    SEQUENCE_KEY = 'cookable:sequence'
+    MAX_CHANGES = 1000
+    CHANGE_TIMEOUT = 24 * 60 * 60
+
+    def __init__(self):
+        self._data = None
+
+    def invalidate(self):
+        self._data = None
+
+    def _change_key(self, number):
+        return f'cookable:change:{number}'
+
+    def _sequence(self):
+        sequence = cache.get(self.SEQUENCE_KEY)
+        if sequence is None:
+            cache.add(self.SEQUENCE_KEY, 0, timeout=None)
+            return cache.get(self.SEQUENCE_KEY, 0)
+        return sequence
+
+    def _build(self, version, sequence):
+        postings = {}
+        recipes = {}
+        rows = IngredientRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator():
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('I')
+            posting.append(recipe_id)
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        return {
+            'version': version,
+            'built': time.monotonic(),
+            'sequence': sequence,
+            'postings': postings,
+            'recipes': recipes,
+        }
+
+    def _catch_up(self, data, sequence):
+        """Применяет журнал изменений; False - нужна полная перестройка."""
+        position = data['sequence']
+        if sequence == position:
+            return True
+        if not 0 < sequence - position <= self.MAX_CHANGES:
+            return False
+        keys = [
+            self._change_key(number)
+            for number in range(position + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        recipe_ids = set(changes.values())
+        ingredients = {}
+        for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+        for recipe_id in recipe_ids:
+            self._replace(data, recipe_id, ingredients.get(recipe_id, set()))
+        data['sequence'] = sequence
+        return True
+
+    def _replace(self, data, recipe_id, new):
+        postings = data['postings']
+        old = data['recipes'].pop(recipe_id, set())
+        for ingredient_id in old - new:
+            posting = array('I', postings.get(ingredient_id, ()))
+            index = bisect.bisect_left(posting, recipe_id)
+            if index < len(posting) and posting[index] == recipe_id:
+                del posting[index]
+            postings[ingredient_id] = posting
+        for ingredient_id in new - old:
+            posting = array('I', postings.get(ingredient_id, ()))
+            bisect.insort(posting, recipe_id)
+            postings[ingredient_id] = posting
+        if new:
+            data['recipes'][recipe_id] = new
+
+    def _load(self):
+        version = get_version(VERSION_GROUP)
+        sequence = self._sequence()
+        data = self._data
+        if (data is None or data['version'] != version
+                or time.monotonic() - data['built'] > settings.INDEX_MAX_AGE
+                or not self._catch_up(data, sequence)):
+            self._data = self._build(version, sequence)
+        return self._data
+
+    def recipe_changed(self, recipe_id):
+        """Отмечает в журнале, что ингредиенты рецепта изменились.
+
+        Вызывается после коммита транзакции; рецепт мог быть и удалён.
+        """
+        try:
+            number = cache.incr(self.SEQUENCE_KEY)
+        except ValueError:
+            cache.add(self.SEQUENCE_KEY, 0, timeout=None)
+            number = cache.incr(self.SEQUENCE_KEY)
+        cache.set(
+            self._change_key(number), recipe_id, timeout=self.CHANGE_TIMEOUT
+        )
+
+    def rank(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+        Возвращает кортежи (id рецепта, доля имеющихся ингредиентов,
+        число недостающих): сначала наибольшее покрытие, затем меньше
+        недостающих, затем новые рецепты.
+        """
+        data = self._load()
+        postings = data['postings']
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            posting = postings.get(ingredient_id)
+            if posting:
+                matched.update(posting)
+        recipes = data['recipes']
+        ranked = []
+        for recipe_id, count in matched.items():
+            total = len(recipes.get(recipe_id, ()))
+            if not total:
+                continue
+            ranked.append((recipe_id, count / total, total - count))
+        ranked.sort(key=lambda item: (-item[1], item[2], -item[0]))
+        return ranked
+
+
+cookable_index = CookableIndex()
@@ -0,0 +1,46 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from users.models import Follow, User
+
+from .models import FavoriteRecipe, Recipe, ShoppingCart
+
+# Денормализованный счётчик: (модель, поле, модель-источник, поле связи).
+COUNTERS = (
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+)
+
+
+def bump(queryset, field, delta=1):
+    """Атомарно изменяет счётчик одним UPDATE, не опуская его ниже нуля."""
+    return queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_count(source, fk):
+    return Coalesce(
+        Subquery(
+            source.objects.filter(**{fk: OuterRef('pk')})
+            .order_by()
+            .values(fk)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0
+    )
+
+
+def drift(model, field, source, fk):
+    """Строки, в которых счётчик разошёлся с реальным количеством."""
+    return model.objects.annotate(
+        actual=actual_count(source, fk)
+    ).exclude(**{field: F('actual')})
+
+
+def recount(model, field, source, fk, pks=None):
+    """Пересчитывает счётчик одним UPDATE - для всех строк или для pks."""
+    queryset = model.objects.all()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return queryset.update(**{field: actual_count(source, fk)})
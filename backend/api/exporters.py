@@ -0,0 +1,32 @@
+import csv
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+    def write(self, value):
+        return value
+
+
+def txt_lines(ingredients):
+    yield 'Список покупок:\n'
+    for ingredient in ingredients:
+        yield (f'{ingredient["name"]}'
+               f' ({ingredient["measurement_unit"]}) - '
+               f'{ingredient["amount"]}\n')
+
+
+def csv_lines(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['amount'],
+        ))
+
+
+EXPORTERS = {
+    'txt': txt_lines,
+    'csv': csv_lines,
+}
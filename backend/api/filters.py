@@ -1,28 +1,62 @@
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
+from . import search
 from .models import Recipe
+from .user_state import get_user_state
+
+
+class MultipleCharField(forms.Field):
+    widget = forms.SelectMultiple
+
+    def to_python(self, value):
+        if not value:
+            return []
+        return [str(item) for item in value]
+
+
+class MultipleCharFilter(filters.Filter):
+    field_class = MultipleCharField
 
 
 class Filter(FilterSet):
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.CharFilter(field_name='tags__slug')
+    tags = MultipleCharFilter(method='get_tags')
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
+
+    def get_tags(self, queryset, name, value):
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tag__slug__in=value
+            )
+        ))
 
     def get_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(
-                favorite_recipe__user=self.request.user
+                pk__in=get_user_state(self.request)['favorites']
             )
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(recipe_cart__user=self.request.user)
+        if value and self.request.user.is_authenticated:
+            return queryset.filter(
+                pk__in=get_user_state(self.request)['cart']
+            )
         return queryset
+
+    def get_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search.search(queryset, value)
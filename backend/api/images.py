@@ -0,0 +1,136 @@
+import base64
+import os
+import tempfile
+from io import BytesIO
+from itertools import islice
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .models import Recipe
+
+THUMBNAIL_SIZES = {
+    'small': 320,
+    'medium': 720,
+}
+CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64(encoded, ext):
+    """Декодирует base64 по частям во временный файл на диске.
+
+    Пробелы и переводы строк (перенос по 76 символов) выбрасываются, а
+    хвост части, не кратный 4, переносится в следующую. Итоговое имя по
+    SHA-256 содержимого назначает хранилище рецептов
+    (api.storage.ContentAddressedStorage).
+    """
+    file = tempfile.TemporaryFile()
+    pending = ''
+    for start in range(0, len(encoded), CHUNK_SIZE):
+        chunk = pending + ''.join(encoded[start:start + CHUNK_SIZE].split())
+        usable = len(chunk) - len(chunk) % 4
+        file.write(base64.b64decode(chunk[:usable]))
+        pending = chunk[usable:]
+    if pending:
+        file.write(base64.b64decode(pending))
+    file.seek(0)
+    return File(file, name=f'image.{ext}')
+
+
+def thumbnail_name(name, size):
+    return f'thumbs/{os.path.splitext(name)[0]}_{size}.webp'
+
+
+def thumbnail_urls(recipe):
+    """Ссылки на миниатюры; пока они не готовы - на оригинал.
+
+    Готовность отмечает make_thumbnails в поле has_thumbnails, чтобы
+    не проверять файлы в хранилище при каждой отрисовке.
+    """
+    return {
+        size: (
+            default_storage.url(thumbnail_name(recipe.image.name, size))
+            if recipe.has_thumbnails
+            else recipe.image.url
+        )
+        for size in THUMBNAIL_SIZES
+    }
+
+
+def release_image(name):
+    """Удаляет файл и его миниатюры, если на него не ссылается ни один
+    рецепт: одно изображение может использоваться в нескольких.
+
+    Проверка и удаление идут под блокировкой хранилища, а недавно
+    загруженный файл не удаляется: его может ждать рецепт из ещё не
+    завершённой транзакции. Такой файл остаётся на диске, даже если
+    рецепт от него сразу отказался.
+    """
+    if not name:
+        return False
+    storage = Recipe._meta.get_field('image').storage
+    with storage.lock():
+        if (Recipe.objects.filter(image=name).exists()
+                or storage.recently_saved(name)):
+            return False
+        storage.delete(name)
+        for size in THUMBNAIL_SIZES:
+            default_storage.delete(thumbnail_name(name, size))
+    return True
+
+
+def sweep_images(batch_size=500):
+    """Удаляет файлы, которые release_image оставил как недавние.
+
+    Проходит хранилище рецептов и удаляет файлы без ссылок из рецептов
+    вместе с миниатюрами, а также брошенные временные файлы; всё, что
+    моложе reuse_period, не трогает. Возвращает число удалённых файлов.
+    """
+    storage = Recipe._meta.get_field('image').storage
+    names = storage.stored_names()
+    removed = 0
+    while True:
+        batch = list(islice(names, batch_size))
+        if not batch:
+            return removed
+        temporary = [
+            name for name in batch
+            if storage.temporary_name.fullmatch(os.path.basename(name))
+        ]
+        for name in temporary:
+            if not storage.recently_saved(name):
+                storage.delete(name)
+                removed += 1
+        used = set(Recipe.objects.filter(image__in=batch).values_list(
+            'image', flat=True
+        ))
+        for name in batch:
+            if name not in used and name not in temporary:
+                removed += release_image(name)
+
+
+def make_thumbnails(name):
+    if not all(default_storage.exists(thumbnail_name(name, size))
+               for size in THUMBNAIL_SIZES):
+        save_thumbnails(name)
+    Recipe.objects.filter(image=name).update(has_thumbnails=True)
+
+
+def save_thumbnails(name):
+    storage = Recipe._meta.get_field('image').storage
+    with storage.open(name) as source:
+        image = Image.open(source)
+        image.load()
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    for size, pixels in THUMBNAIL_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail((pixels, pixels))
+        buffer = BytesIO()
+        thumbnail.save(buffer, 'WEBP', quality=80)
+        path = thumbnail_name(name, size)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(buffer.getvalue()))
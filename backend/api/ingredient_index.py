@@ -0,0 +1,61 @@
+import bisect
+import time
+
+from django.conf import settings
+
+from .cache import get_version
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Названия хранятся отсортированными, поэтому совпадения по началу
+    названия находятся бинарным поиском, а совпадения по подстроке
+    выдаются после них. Индекс перестраивается, когда версия группы
+    'ingredients' в кэше меняется в любом из процессов, и не реже чем
+    раз в INDEX_MAX_AGE секунд.
+    """
+
+    def __init__(self):
+        self._data = None
+
+    def invalidate(self):
+        self._data = None
+
+    def _load(self):
+        version = get_version('ingredients')
+        data = self._data
+        if (data is None or data[0] != version
+                or time.monotonic() - data[1] > settings.INDEX_MAX_AGE):
+            rows = sorted(
+                (name.casefold(), pk, name, measurement_unit)
+                for pk, name, measurement_unit in
+                Ingredient.objects.values_list(
+                    'id', 'name', 'measurement_unit'
+                )
+            )
+            names = [row[0] for row in rows]
+            items = [
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in rows
+            ]
+            data = self._data = (version, time.monotonic(), names, items)
+        return data[2:]
+
+    def search(self, query):
+        names, items = self._load()
+        query = query.strip().casefold()
+        if not query:
+            return list(items)
+        start = bisect.bisect_left(names, query)
+        end = start
+        while end < len(names) and names[end].startswith(query):
+            end += 1
+        return items[start:end] + [
+            item for name, item in zip(names, items)
+            if query in name and not name.startswith(query)
+        ]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,181 @@
+import json
+import statistics
+import time
+from collections import Counter
+
+from api.models import IngredientRecipe, Recipe, Tag
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from users.models import User
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число SQL-запросов и пропускную '
+            'способность основных эндпоинтов API')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Запросов на каждый эндпоинт')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--user', help='username пользователя; по '
+                            'умолчанию - с самым большим списком покупок '
+                            'и избранным')
+        parser.add_argument('--only', nargs='*', default=(),
+                            help='Замерять только эти эндпоинты')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кэш перед каждым запросом')
+        parser.add_argument('--json', metavar='PATH',
+                            help='Сохранить результаты в JSON')
+        parser.add_argument('--compare', metavar='PATH',
+                            help='JSON прошлого запуска для сравнения p50')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        endpoints = self.endpoints(user)
+        if options['only']:
+            endpoints = [
+                endpoint for endpoint in endpoints
+                if endpoint[0] in options['only']
+            ]
+        baseline = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = {
+                    row['name']: row for row in json.load(file)['results']
+                }
+        results = []
+        for name, path, authenticated in endpoints:
+            client = APIClient()
+            if authenticated:
+                client.force_authenticate(user)
+            result = self.measure(client, name, path, options)
+            results.append(result)
+            self.report(result, baseline.get(name))
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'vendor': connection.vendor,
+                    'user': user.username,
+                    'requests': options['requests'],
+                    'cold': options['cold'],
+                    'results': results,
+                }, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["json"]}')
+
+    def get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            user = User.objects.annotate(
+                cart=Count('user_cart', distinct=True),
+                favorites=Count('favoriterecipe', distinct=True)
+            ).order_by('-cart', '-favorites', 'pk').first()
+        if user is None:
+            raise CommandError(
+                'Нет пользователей; сначала запустите generate_data'
+            )
+        return user
+
+    def endpoints(self, user):
+        """(имя, путь, нужна ли авторизация) по данным из базы."""
+        recipe = Recipe.objects.order_by('-favorites_count', '-pk').first()
+        if recipe is None:
+            raise CommandError('Нет рецептов; сначала запустите generate_data')
+        author = User.objects.order_by('-recipes_count', 'pk').first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        ingredients = list(IngredientRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', 'ingredient__name'))
+        word = recipe.name.split()[0]
+        prefix = ingredients[0][1][:3] if ingredients else 'а'
+        have = ','.join(str(pk) for pk, _ in ingredients[:3])
+        tag_query = '&'.join(f'tags={slug}' for slug in tags)
+        return [
+            ('recipes', '/api/recipes/?limit=6', False),
+            ('recipes_deep_page', '/api/recipes/?limit=6&page=100', False),
+            ('recipes_cursor', '/api/recipes/?limit=6&cursor=', False),
+            ('recipes_tags', f'/api/recipes/?limit=6&{tag_query}', False),
+            ('recipes_author', f'/api/recipes/?limit=6&author={author.pk}',
+             False),
+            ('recipes_favorited', '/api/recipes/?limit=6&is_favorited=1',
+             True),
+            ('recipes_in_cart', '/api/recipes/?limit=6&is_in_shopping_cart=1',
+             True),
+            ('recipes_search', f'/api/recipes/?limit=6&search={word}', False),
+            ('recipe_detail', f'/api/recipes/{recipe.pk}/', True),
+            ('subscriptions', '/api/users/subscriptions/?recipes_limit=3',
+             True),
+            ('download_shopping_cart',
+             '/api/recipes/download_shopping_cart/', True),
+            ('shopping_cart_json',
+             '/api/recipes/download_shopping_cart/?format=json', True),
+            ('ingredients_search', f'/api/ingredients/?name={prefix}', False),
+            ('feed', '/api/recipes/feed/?limit=6', True),
+            ('recommendations', '/api/recipes/recommendations/?limit=6', True),
+            ('cookable', f'/api/recipes/cookable/?limit=6&ingredients={have}',
+             False),
+        ]
+
+    def request(self, client, path, cold):
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(queries)
+
+    def measure(self, client, name, path, options):
+        for _ in range(options['warmup']):
+            self.request(client, path, options['cold'])
+        statuses = Counter()
+        latencies = []
+        queries = []
+        for _ in range(options['requests']):
+            status, elapsed, count = self.request(
+                client, path, options['cold']
+            )
+            statuses[status] += 1
+            latencies.append(elapsed * 1000)
+            queries.append(count)
+        return {
+            'name': name,
+            'path': path,
+            'statuses': {str(code): count for code, count in statuses.items()},
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'mean_ms': round(statistics.mean(latencies), 2),
+            'queries': round(statistics.mean(queries), 1),
+            'rps': round(len(latencies) / (sum(latencies) / 1000), 1),
+        }
+
+    def report(self, result, previous):
+        line = (
+            f'{result["name"]:<24} p50 {result["p50_ms"]:>8.2f} мс  '
+            f'p95 {result["p95_ms"]:>8.2f} мс  '
+            f'запросов {result["queries"]:>5}  '
+            f'{result["rps"]:>7.1f} rps'
+        )
+        if previous:
+            change = (result['p50_ms'] / previous['p50_ms'] - 1) * 100
+            line += f'  p50 {change:+.0f}%'
+        errors = {
+            code: count for code, count in result['statuses'].items()
+            if not code.startswith('2')
+        }
+        if errors:
+            self.stdout.write(self.style.WARNING(f'{line}  ошибки {errors}'))
+        else:
+            self.stdout.write(line)
@@ -0,0 +1,114 @@
+import heapq
+import random
+import time
+from itertools import accumulate
+
+from api import recommendations
+from django.core.management.base import BaseCommand
+
+from .benchmark_api import percentile
+
+
+def zipf_weights(size):
+    return list(accumulate(1 / (rank + 1) for rank in range(size)))
+
+
+def synthetic(recipes, seed):
+    """Случайные данные с «длинным хвостом», как у настоящих рецептов."""
+    rng = random.Random(seed)
+    ingredients = range(2000)
+    ingredient_weights = zipf_weights(len(ingredients))
+    recipe_ids = range(1, recipes + 1)
+    recipe_weights = zipf_weights(recipes)
+    recipe_ingredients = {
+        recipe_id: set(rng.choices(
+            ingredients, cum_weights=ingredient_weights, k=rng.randint(4, 12)
+        ))
+        for recipe_id in recipe_ids
+    }
+    recipe_tags = {
+        recipe_id: set(rng.sample(range(12), rng.randint(1, 3)))
+        for recipe_id in recipe_ids
+    }
+    user_items = {
+        user_id: set(rng.choices(
+            recipe_ids, cum_weights=recipe_weights, k=rng.randint(1, 30)
+        ))
+        for user_id in range(recipes // 2)
+    }
+    return recipe_ingredients, recipe_tags, user_items
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие рецепты для рекомендаций'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=recommendations.TOP_K,
+            help='Сколько похожих рецептов хранить для каждого рецепта',
+        )
+        parser.add_argument(
+            '--benchmark',
+            type=int,
+            metavar='RECIPES',
+            help='Не трогая базу, замерить построение и выдачу '
+                 'на синтетических данных из RECIPES рецептов',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['benchmark']:
+            self.benchmark(
+                options['benchmark'], options['top_k'], options['seed']
+            )
+            return
+        started = time.perf_counter()
+        total = recommendations.build(top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено пар похожих рецептов: {total} '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
+
+    def benchmark(self, recipes, top_k, seed):
+        started = time.perf_counter()
+        recipe_ingredients, recipe_tags, user_items = synthetic(recipes, seed)
+        self.stdout.write(
+            f'Данные: {recipes} рецептов, {len(user_items)} пользователей '
+            f'за {time.perf_counter() - started:.1f} с'
+        )
+        started = time.perf_counter()
+        neighbours = dict(recommendations.compute_similarities(
+            recipe_ingredients, recipe_tags, user_items, top_k=top_k
+        ))
+        elapsed = time.perf_counter() - started
+        pairs = sum(map(len, neighbours.values()))
+        self.stdout.write(
+            f'Построение: {elapsed:.1f} с, {pairs} пар, '
+            f'{len(neighbours) / elapsed:.0f} рецептов/с'
+        )
+        rng = random.Random(seed)
+        latencies = []
+        users = rng.sample(list(user_items), min(1000, len(user_items)))
+        for user_id in users:
+            seeds = user_items[user_id]
+            started = time.perf_counter()
+            scores = recommendations.combine(
+                (
+                    pair for recipe_id in seeds
+                    for pair in neighbours.get(recipe_id, ())
+                ),
+                seeds
+            )
+            heapq.nlargest(
+                recommendations.RECOMMENDATIONS_SIZE,
+                scores.items(),
+                key=lambda item: item[1]
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(self.style.SUCCESS(
+            f'Выдача без кэша и базы: p50 {percentile(latencies, 50):.2f} мс, '
+            f'p95 {percentile(latencies, 95):.2f} мс '
+            f'на {len(latencies)} пользователях'
+        ))
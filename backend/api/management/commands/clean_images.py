@@ -0,0 +1,13 @@
+from api.images import sweep_images
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Удаляет изображения рецептов и миниатюры, на которые '
+            'не ссылается ни один рецепт')
+
+    def handle(self, *args, **options):
+        removed = sweep_images()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {removed}'
+        ))
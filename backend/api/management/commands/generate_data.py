@@ -0,0 +1,238 @@
+import io
+import random
+import time
+from itertools import accumulate
+
+from api import cart, search, timeline
+from api.cache import bump_version
+from api.cookable import VERSION_GROUP
+from api.models import (FavoriteRecipe, Ingredient, IngredientRecipe, Recipe,
+                        ShoppingCart, Tag)
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.db.models import Max
+from PIL import Image
+from users.models import Follow, User
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F5A9B8', 'dessert'),
+    ('Выпечка', '#C9A227', 'baking'),
+    ('Суп', '#2D9CDB', 'soup'),
+    ('Салат', '#6FCF97', 'salad'),
+    ('Вегетарианское', '#27AE60', 'vegetarian'),
+)
+WORDS = (
+    'быстрый', 'домашний', 'пряный', 'сливочный', 'овощной', 'сырный',
+    'летний', 'зимний', 'бабушкин', 'лёгкий', 'острый', 'сладкий',
+)
+DISHES = (
+    'пирог', 'суп', 'салат', 'омлет', 'плов', 'рагу', 'кекс', 'борщ',
+    'соус', 'паштет', 'запеканка', 'каша',
+)
+
+
+class Zipf:
+    """Выбор с убывающей частотой: первые элементы популярнее остальных.
+
+    Так распределены и ингредиенты по рецептам, и подписчики по авторам,
+    и лайки по рецептам.
+    """
+
+    def __init__(self, rng, items, exponent=1.0):
+        self.rng = rng
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.weights = list(accumulate(
+            1 / (rank + 1) ** exponent for rank in range(len(self.items))
+        ))
+
+    def sample(self, count):
+        count = min(count, len(self.items))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(self.rng.choices(
+                self.items, cum_weights=self.weights, k=count - len(chosen)
+            ))
+        return chosen
+
+
+def placeholder_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (226, 108, 45)).save(buffer, 'PNG')
+    storage = Recipe._meta.get_field('image').storage
+    return storage.save('placeholder.png', ContentFile(buffer.getvalue()))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу воспроизводимыми синтетическими данными '
+            'для замеров производительности')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Подписок у пользователя в среднем')
+        parser.add_argument('--favorites', type=int, default=30,
+                            help='Рецептов в избранном в среднем')
+        parser.add_argument('--cart', type=int, default=8,
+                            help='Рецептов в списке покупок в среднем')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--recommendations',
+            action='store_true',
+            help='Сразу построить похожие рецепты для рекомендаций',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'gen{options["seed"]}_'
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Данные с --seed {options["seed"]} уже созданы'
+            )
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        self.step('Теги', self.create_tags)
+        users = self.step('Пользователи', self.create_users, options['users'])
+        recipes = self.step(
+            'Рецепты', self.create_recipes, users, options['recipes']
+        )
+        self.step('Ингредиенты и теги рецептов', self.fill_recipes, recipes)
+        self.step(
+            'Подписки', self.create_relations, Follow, 'author',
+            users, users, options['follows']
+        )
+        self.step(
+            'Избранное', self.create_relations, FavoriteRecipe, 'recipe',
+            users, recipes, options['favorites']
+        )
+        self.step(
+            'Списки покупок', self.create_relations, ShoppingCart, 'recipe',
+            users, recipes, options['cart']
+        )
+        self.step('Производные данные', self.rebuild_derived, recipes)
+        if options['recommendations']:
+            self.step(
+                'Рекомендации', call_command, 'build_recommendations',
+                stdout=self.stdout
+            )
+
+    def step(self, title, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stdout.write(
+            f'{title}: {time.perf_counter() - started:.1f} с'
+            + (f', {len(result)}' if isinstance(result, list) else '')
+        )
+        return result
+
+    def insert(self, model, objects, **kwargs):
+        for start in range(0, len(objects), self.batch_size):
+            model.objects.bulk_create(
+                objects[start:start + self.batch_size], **kwargs
+            )
+            # При DEBUG = True Django копит тексты огромных INSERT.
+            reset_queries()
+
+    def inserted_ids(self, model, objects, **kwargs):
+        """Вставляет объекты и возвращает их id в порядке вставки.
+
+        SQLite в Django 3.2 не возвращает id из bulk_create, поэтому
+        они читаются обратно: новые id больше максимального старого.
+        """
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.insert(model, objects, **kwargs)
+        return list(model.objects.filter(pk__gt=last).order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+
+    def create_tags(self):
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+
+    @transaction.atomic
+    def create_users(self, count):
+        password = make_password('benchmark')
+        return self.inserted_ids(User, [
+            User(
+                username=f'{self.prefix}{number}',
+                email=f'{self.prefix}{number}@example.com',
+                first_name='Тест',
+                last_name=f'Пользователь {number}',
+                password=password,
+            )
+            for number in range(count)
+        ])
+
+    @transaction.atomic
+    def create_recipes(self, users, count):
+        image = placeholder_image()
+        authors = Zipf(self.rng, users)
+        rng = self.rng
+        return self.inserted_ids(Recipe, [
+            Recipe(
+                author_id=authors.sample(1).pop(),
+                name=f'{rng.choice(DISHES).capitalize()} {number}',
+                text=(f'{rng.choice(WORDS).capitalize()} '
+                      f'{rng.choice(DISHES)}: '
+                      + ', '.join(rng.sample(WORDS, 4)) + '.'),
+                image=image,
+                cooking_time=rng.randint(5, 180),
+            )
+            for number in range(count)
+        ])
+
+    @transaction.atomic
+    def fill_recipes(self, recipes):
+        ingredients = Zipf(self.rng, Ingredient.objects.order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+        tags = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+        rows = []
+        links = []
+        for recipe_id in recipes:
+            for ingredient_id in ingredients.sample(self.rng.randint(3, 12)):
+                rows.append(IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500)
+                ))
+            for tag_id in self.rng.sample(tags, self.rng.randint(1, 3)):
+                links.append(Recipe.tags.through(
+                    recipe_id=recipe_id, tag_id=tag_id
+                ))
+        self.insert(IngredientRecipe, rows)
+        self.insert(Recipe.tags.through, links)
+        return rows
+
+    @transaction.atomic
+    def create_relations(self, model, field, users, targets, average):
+        popular = Zipf(self.rng, targets)
+        rows = []
+        for user_id in users:
+            for target_id in popular.sample(self.rng.randint(0, 2 * average)):
+                if field == 'author' and target_id == user_id:
+                    continue
+                rows.append(model(user_id=user_id, **{
+                    f'{field}_id': target_id
+                }))
+        self.insert(model, rows, ignore_conflicts=True)
+        return rows
+
+    def rebuild_derived(self, recipes):
+        call_command('recount_counters', stdout=io.StringIO())
+        cart.rebuild()
+        for start in range(0, len(recipes), 500):
+            search.update_search_vector(recipes[start:start + 500])
+        timeline.rebuild()
+        bump_version(VERSION_GROUP)
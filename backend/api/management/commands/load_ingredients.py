@@ -0,0 +1,84 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from api.cache import bump_version
+from api.models import Ingredient
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(settings.BASE_DIR), 'data', 'ingredients.csv'
+)
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if len(row) >= 2:
+                yield row[0], row[1]
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as file:
+        for row in json.load(file):
+            yield row['name'], row['measurement_unit']
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON пакетными вставками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json')
+        if not os.path.exists(path):
+            raise CommandError(f'Файл {path} не найден')
+
+        started = time.monotonic()
+        rows = self.unique_rows(reader(path))
+        before = Ingredient.objects.count()
+        with transaction.atomic():
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create(
+                    [
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in batch
+                    ],
+                    ignore_conflicts=True
+                )
+        # bulk_create не отправляет сигналы, поэтому кэш сбрасываем сами.
+        bump_version('ingredients')
+        elapsed = time.monotonic() - started
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {self.total}, добавлено: {created}, '
+            f'{self.total / elapsed:.0f} строк/с'
+        ))
+
+    def unique_rows(self, rows):
+        seen = set()
+        self.total = 0
+        for name, unit in rows:
+            self.total += 1
+            key = (name.strip(), unit.strip())
+            if key[0] and key not in seen:
+                seen.add(key)
+                yield key
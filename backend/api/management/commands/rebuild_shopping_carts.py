@@ -0,0 +1,23 @@
+from api import cart
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает суммарные списки покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args, **options):
+        count = len(cart.drift())
+        self.stdout.write(f'Расхождений в списках покупок: {count}')
+        if options['check']:
+            if count:
+                raise CommandError(f'Найдено расхождений: {count}')
+            return
+        cart.rebuild()
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
@@ -0,0 +1,13 @@
+from api import timeline
+from api.models import TimelineEntry
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок пользователей'
+
+    def handle(self, *args, **options):
+        timeline.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {TimelineEntry.objects.count()}'
+        ))
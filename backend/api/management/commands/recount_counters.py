@@ -0,0 +1,35 @@
+from api.counters import COUNTERS, drift, recount
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики рецептов и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить расхождения, ничего не исправляя',
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for counter in COUNTERS:
+            model, field = counter[:2]
+            with transaction.atomic():
+                count = drift(*counter).count()
+                if count and not options['check']:
+                    recount(*counter)
+            total += count
+            self.stdout.write(
+                f'{model._meta.label}.{field}: расхождений - {count}'
+            )
+        if options['check'] and total:
+            raise CommandError(f'Найдено расхождений: {total}')
+        if total:
+            self.stdout.write(
+                self.style.SUCCESS(f'Исправлено расхождений: {total}')
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.15 on 2026-10-18 17:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    counters = (
+        ('users', 'User', 'recipes_count', 'Recipe', 'author'),
+        ('users', 'User', 'followers_count', 'Follow', 'author'),
+        ('api', 'Recipe', 'favorites_count', 'FavoriteRecipe', 'recipe'),
+        ('api', 'Recipe', 'shopping_cart_count', 'ShoppingCart', 'recipe'),
+    )
+    for app, model_name, field, source_name, fk in counters:
+        model = apps.get_model(app, model_name)
+        source = apps.get_model(
+            'users' if source_name == 'Follow' else 'api', source_name
+        )
+        count = Subquery(
+            source.objects.filter(**{fk: OuterRef('pk')})
+            .order_by()
+            .values(fk)
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        model.objects.update(**{field: Coalesce(count, 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_auto_20220919_1100'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном у пользователей'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В списках покупок у пользователей'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
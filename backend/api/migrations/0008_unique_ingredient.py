@@ -0,0 +1,53 @@
+# Generated by Django 3.2.15 on 2026-10-18 17:36
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    Ingredient = apps.get_model('api', 'Ingredient')
+    IngredientRecipe = apps.get_model('api', 'IngredientRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep=Min('id'), count=Count('id')).filter(count__gt=1)
+    for group in duplicates:
+        keep = group['keep']
+        extra = Ingredient.objects.filter(
+            name=group['name'],
+            measurement_unit=group['measurement_unit'],
+        ).exclude(id=keep)
+        for row in IngredientRecipe.objects.filter(ingredient__in=extra):
+            existing = IngredientRecipe.objects.filter(
+                recipe_id=row.recipe_id, ingredient_id=keep
+            ).first()
+            if existing is None:
+                row.ingredient_id = keep
+                row.save(update_fields=['ingredient'])
+            else:
+                existing.amount += row.amount
+                existing.save(update_fields=['amount'])
+                row.delete()
+        extra.delete()
+
+
+def check_constraints_now(apps, schema_editor):
+    # Внешние ключи в PostgreSQL отложенные: без этого ALTER TABLE после
+    # изменений выше падает с "pending trigger events".
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(check_constraints_now, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.15 on 2026-10-18 17:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_recipe_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ['-pub_date', '-id'], 'verbose_name_plural': 'Рецепты'},
+        ),
+    ]
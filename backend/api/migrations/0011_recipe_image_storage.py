@@ -0,0 +1,19 @@
+# Generated by Django 3.2.15 on 2026-10-18 17:40
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_recipe_ordering_tiebreak'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=api.storage.ContentAddressedStorage(), upload_to='', verbose_name='Фото рецепта'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2.15 on 2026-10-18 17:46
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+INGREDIENT_NAMES = '''
+    SELECT {aggregate}
+    FROM api_ingredientrecipe ir
+    JOIN api_ingredient i ON i.id = ir.ingredient_id
+    WHERE ir.recipe_id = r.id
+'''
+
+POSTGRES_FORWARD = [
+    'CREATE INDEX recipe_search_vector_idx ON api_recipe '
+    'USING gin (search_vector)',
+    '''
+    UPDATE api_recipe r SET search_vector =
+        setweight(to_tsvector('russian', coalesce(r.name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(({names}), '')), 'B')
+        || setweight(to_tsvector('russian', coalesce(r.text, '')), 'C')
+    '''.format(names=INGREDIENT_NAMES.format(
+        aggregate="string_agg(i.name, ' ')"
+    )),
+]
+POSTGRES_BACKWARD = ['DROP INDEX IF EXISTS recipe_search_vector_idx']
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_recipe_fts USING fts5("
+    "name, ingredients, text, tokenize='unicode61 remove_diacritics 2')",
+    '''
+    INSERT INTO api_recipe_fts(rowid, name, ingredients, text)
+    SELECT r.id, r.name, coalesce(({names}), ''), r.text FROM api_recipe r
+    '''.format(names=INGREDIENT_NAMES.format(
+        aggregate="group_concat(i.name, ' ')"
+    )),
+]
+SQLITE_BACKWARD = ['DROP TABLE IF EXISTS api_recipe_fts']
+
+STATEMENTS = {
+    'postgresql': (POSTGRES_FORWARD, POSTGRES_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def run(direction):
+    def run_statements(apps, schema_editor):
+        statements = STATEMENTS.get(schema_editor.connection.vendor)
+        if statements:
+            for sql in statements[direction]:
+                schema_editor.execute(sql)
+    return run_statements
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_shopping_cart_ingredients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(run(0), run(1)),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.15 on 2026-10-18 18:07
+
+import os
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+THUMBNAIL_SIZES = ('small', 'medium')
+
+
+def mark_thumbnails(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    names = Recipe.objects.exclude(image='').order_by().values_list(
+        'image', flat=True
+    ).distinct()
+    ready = [
+        name for name in names.iterator()
+        if all(
+            default_storage.exists(
+                f'thumbs/{os.path.splitext(name)[0]}_{size}.webp'
+            )
+            for size in THUMBNAIL_SIZES
+        )
+    ]
+    Recipe.objects.filter(image__in=ready).update(has_thumbnails=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Миниатюры готовы'),
+        ),
+        migrations.RunPython(mark_thumbnails, migrations.RunPython.noop),
+    ]
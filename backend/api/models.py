@@ -1,7 +1,11 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Prefetch
 from users.models import User
 
+from .storage import ContentAddressedStorage
+
 
 class Ingredient(models.Model):
     name = models.CharField(
@@ -18,6 +22,12 @@ class Ingredient(models.Model):
 
     class Meta:
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
 
 class Tag(models.Model):
@@ -46,6 +56,24 @@ class Tag(models.Model):
         verbose_name_plural = 'Тэги'
 
 
+def recipe_related_lookups():
+    """Тэги и ингредиенты рецептов фиксированным числом запросов."""
+    return (
+        'tags',
+        Prefetch(
+            'ingredientrecipe_set',
+            queryset=IngredientRecipe.objects.select_related('ingredient')
+        ),
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            *recipe_related_lookups()
+        ).defer('search_vector')
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -61,7 +89,13 @@ class Recipe(models.Model):
         verbose_name='Описание рецепта',
     )
     image = models.ImageField(
-        verbose_name='Фото рецепта'
+        verbose_name='Фото рецепта',
+        storage=ContentAddressedStorage(),
+    )
+    has_thumbnails = models.BooleanField(
+        verbose_name='Миниатюры готовы',
+        default=False,
+        editable=False,
     )
     tags = models.ManyToManyField(
         Tag,
@@ -90,13 +124,38 @@ class Recipe(models.Model):
         verbose_name='В списке покупок',
         default=False,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном у пользователей',
+        default=0,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок у пользователей',
+        default=0,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     def __str__(self):
         return f'{self.name}, {self.author}'
 
     class Meta:
         verbose_name_plural = 'Рецепты'
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
@@ -189,3 +248,100 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил в избанное {self.recipe}'
+
+
+class ShoppingCartIngredient(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя.
+
+    Поддерживается api.cart при каждом изменении списка покупок и
+    ингредиентов рецептов из него.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+class RecipeSimilarity(models.Model):
+    """Похожий рецепт и степень сходства; строится build_recommendations."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similarities',
+        verbose_name='Рецепт'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    class Meta:
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_recipe_similarity'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} ~ {self.similar_id}: {self.score:.3f}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика его автора; лента ограничена по длине."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe_id}'
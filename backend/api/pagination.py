@@ -1,5 +1,197 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (LimitOffsetPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка числа строк таблицы из статистики PostgreSQL."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def cached_count(queryset):
+    """Количество строк выборки и признак того, что оно точное.
+
+    Результат кэшируется на PAGINATION_COUNT_CACHE_TIMEOUT секунд по
+    тексту SQL-запроса, то есть отдельно для каждого набора фильтров.
+    Для выборки без фильтров по большой таблице вместо COUNT(*)
+    берётся оценка из pg_class.reltuples.
+    """
+    queryset = queryset.order_by().values('pk')
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, True
+    key = 'count:' + hashlib.md5(f'{sql}{params!r}'.encode()).hexdigest()
+    result = cache.get(key)
+    if result is None:
+        estimate = None
+        if not queryset.query.where:
+            estimate = estimate_count(queryset)
+        if (estimate is not None
+                and estimate >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD):
+            result = (estimate, False)
+        else:
+            result = (queryset.count(), True)
+        cache.set(key, result, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return result
+
+
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            self.count_exact = True
+            return len(self.object_list)
+        count, self.count_exact = cached_count(self.object_list)
+        return count
+
+
+class CachedCountLimitOffsetPagination(LimitOffsetPagination):
+    def get_count(self, queryset):
+        count, self.count_exact = cached_count(queryset)
+        return count
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('count_exact', self.count_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
 
 
 class LimitPagination(PageNumberPagination):
+    """Постраничная пагинация с параметром limit.
+
+    Если у представления задан `cursor_ordering`, а в запросе передан
+    параметр cursor (для первой страницы - пустой), включается
+    курсорная пагинация по ключу сортировки: без OFFSET и COUNT(*),
+    и вставка новых записей не сдвигает уже выданные страницы.
+    Курсор не применяется, если передан один из `relevance_query_params`:
+    такие выборки упорядочены по релевантности, а не по ключу курсора,
+    и отдаются обычными страницами.
+    """
+    django_paginator_class = CachedCountPaginator
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    relevance_query_params = ('search',)
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'cursor_ordering', None)
+        self.cursor_mode = bool(ordering and self.use_cursor(request))
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        fields = [
+            (name.lstrip('-'), name.startswith('-')) for name in ordering
+        ]
+        opts = queryset.model._meta
+        position = self.decode_cursor(request, opts, fields)
+        if position is not None:
+            queryset = queryset.filter(self.after(fields, position))
+        page = list(queryset.order_by(*ordering)[:page_size + 1])
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = [
+                str(getattr(page[-1], opts.get_field(name).attname))
+                for name, _ in fields
+            ]
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return Response(OrderedDict([
+                ('count', self.page.paginator.count),
+                ('count_exact', self.page.paginator.count_exact),
+                ('next', self.get_next_link()),
+                ('previous', self.get_previous_link()),
+                ('results', data)
+            ]))
+        return Response({
+            'next': self.get_next_cursor_link(),
+            'results': data,
+        })
+
+    def use_cursor(self, request):
+        params = request.query_params
+        if any(params.get(name, '').strip()
+               for name in self.relevance_query_params):
+            return False
+        return self.cursor_query_param in params
+
+    def decode_cursor(self, request, opts, fields):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(fields):
+                raise ValueError
+            return [
+                opts.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, fields, position):
+        """Условие "строго после позиции" для составного ключа."""
+        conditions = []
+        for index, (name, descending) in enumerate(fields):
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            equal = {
+                prev: value for (prev, _), value
+                in zip(fields[:index], position[:index])
+            }
+            conditions.append(Q(**equal, **{lookup: position[index]}))
+        return reduce(or_, conditions)
+
+    def get_next_cursor_link(self):
+        if self.next_position is None:
+            return None
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(self.next_position).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            encoded
+        )
+
+
+class LimitCursorPagination(LimitPagination):
+    """Только курсорная пагинация, даже без параметра cursor."""
+
+    def use_cursor(self, request):
+        return True
@@ -0,0 +1,247 @@
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain, islice, zip_longest
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import (FavoriteRecipe, IngredientRecipe, Recipe,
+                     RecipeSimilarity, ShoppingCart)
+from .user_state import get_user_state
+
+# Вклад составляющих в сходство рецептов.
+CO_OCCURRENCE_WEIGHT = 0.6
+INGREDIENTS_WEIGHT = 0.3
+TAGS_WEIGHT = 0.1
+# Ингредиенты, которые есть в большем числе рецептов (соль, вода),
+# ничего не говорят о сходстве и пропускаются - грубая замена IDF.
+MAX_INGREDIENT_RECIPES = 500
+# Пользователи с огромным избранным тоже мало что говорят о сходстве.
+MAX_USER_ITEMS = 200
+MAX_RECIPE_USERS = 500
+TOP_K = 20
+
+# Рекомендации пользователю: сколько хранить в кэше и по скольким
+# последним рецептам из его избранного и списка покупок их считать.
+RECOMMENDATIONS_SIZE = 100
+MAX_SEEDS = 200
+FOLLOW_BONUS = 0.2
+
+
+def invert(mapping):
+    """{ключ: [значения]} -> {значение: array('I') ключей}."""
+    inverted = defaultdict(lambda: array('I'))
+    for key in sorted(mapping):
+        for value in mapping[key]:
+            inverted[value].append(key)
+    return dict(inverted)
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def compute_similarities(recipe_ingredients, recipe_tags, user_items,
+                         top_k=TOP_K):
+    """Для каждого рецепта выдаёт top_k похожих: (id, [(id, сходство)]).
+
+    Сходство складывается из косинусной меры по общим пользователям
+    (избранное и список покупок), по общим ингредиентам и из доли общих
+    тегов. Матрица не строится целиком: строки считаются по очереди
+    через инвертированные индексы, поэтому память - O(рецептов * top_k).
+    """
+    postings = {
+        ingredient: recipes
+        for ingredient, recipes in invert(recipe_ingredients).items()
+        if len(recipes) <= MAX_INGREDIENT_RECIPES
+    }
+    user_items = {
+        user: array('I', sorted(items))
+        for user, items in user_items.items()
+        if 1 < len(items) <= MAX_USER_ITEMS
+    }
+    recipe_users = invert(user_items)
+    # 1 / sqrt(длины вектора) рецепта для косинусной меры.
+    ingredients_norm = {
+        recipe_id: 1 / math.sqrt(len(ingredients))
+        for recipe_id, ingredients in recipe_ingredients.items()
+        if ingredients
+    }
+    users_norm = {
+        recipe_id: 1 / math.sqrt(len(users))
+        for recipe_id, users in recipe_users.items()
+    }
+    for recipe_id in recipe_ingredients.keys() | recipe_users.keys():
+        shared = Counter()
+        for ingredient in recipe_ingredients.get(recipe_id, ()):
+            recipes = postings.get(ingredient)
+            if recipes:
+                shared.update(recipes)
+        weight = INGREDIENTS_WEIGHT * ingredients_norm.get(recipe_id, 0)
+        scores = {
+            similar_id: weight * count * ingredients_norm[similar_id]
+            for similar_id, count in shared.items()
+        }
+        together = Counter()
+        for user in recipe_users.get(recipe_id, ())[-MAX_RECIPE_USERS:]:
+            together.update(user_items[user])
+        weight = CO_OCCURRENCE_WEIGHT * users_norm.get(recipe_id, 0)
+        for similar_id, count in together.items():
+            scores[similar_id] = (
+                scores.get(similar_id, 0.0)
+                + weight * count * users_norm[similar_id]
+            )
+        scores.pop(recipe_id, None)
+        if not scores:
+            continue
+        tags = recipe_tags.get(recipe_id)
+        candidates = heapq.nlargest(
+            top_k * 3, scores.items(), key=itemgetter(1)
+        )
+        yield recipe_id, heapq.nlargest(top_k, (
+            (similar_id, score + TAGS_WEIGHT * jaccard(
+                tags, recipe_tags.get(similar_id)
+            ))
+            for similar_id, score in candidates
+        ), key=itemgetter(1))
+
+
+def load_sources():
+    """Ингредиенты и теги рецептов и рецепты пользователей из базы."""
+    recipe_ingredients = defaultdict(list)
+    for recipe_id, ingredient_id in IngredientRecipe.objects.values_list(
+        'recipe_id', 'ingredient_id'
+    ).iterator():
+        recipe_ingredients[recipe_id].append(ingredient_id)
+    recipe_tags = defaultdict(set)
+    for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+        'recipe_id', 'tag_id'
+    ).iterator():
+        recipe_tags[recipe_id].add(tag_id)
+    user_items = defaultdict(set)
+    for model in (FavoriteRecipe, ShoppingCart):
+        for user_id, recipe_id in model.objects.values_list(
+            'user_id', 'recipe_id'
+        ).iterator():
+            user_items[user_id].add(recipe_id)
+    return recipe_ingredients, recipe_tags, user_items
+
+
+def build(top_k=TOP_K, batch_size=5000):
+    """Пересчитывает RecipeSimilarity целиком; возвращает число строк."""
+    rows = (
+        RecipeSimilarity(recipe_id=recipe_id, similar_id=similar_id,
+                         score=score)
+        for recipe_id, neighbours in compute_similarities(
+            *load_sources(), top_k=top_k
+        )
+        for similar_id, score in neighbours
+    )
+    total = 0
+    with transaction.atomic():
+        RecipeSimilarity.objects.all().delete()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            RecipeSimilarity.objects.bulk_create(batch)
+            total += len(batch)
+    return total
+
+
+def combine(neighbours, seeds):
+    """Суммирует сходство кандидатов со всеми рецептами-источниками."""
+    scores = defaultdict(float)
+    for similar_id, score in neighbours:
+        if similar_id not in seeds:
+            scores[similar_id] += score
+    return scores
+
+
+def popular(exclude, user_id, limit):
+    queryset = Recipe.objects.exclude(pk__in=exclude)
+    if user_id is not None:
+        queryset = queryset.exclude(author_id=user_id)
+    return list(queryset.order_by(
+        '-favorites_count', '-pub_date', '-id'
+    ).values_list('pk', flat=True)[:limit])
+
+
+def recent_seeds(user_id, seeds):
+    """Не больше MAX_SEEDS последних сохранённых рецептов пользователя.
+
+    Порядок сохранения берётся из id строк избранного и списка покупок;
+    последние рецепты из обоих списков идут вперемешку.
+    """
+    if len(seeds) <= MAX_SEEDS:
+        return seeds
+    latest = [
+        model.objects.filter(user_id=user_id).order_by('-id').values_list(
+            'recipe_id', flat=True
+        )[:MAX_SEEDS]
+        for model in (FavoriteRecipe, ShoppingCart)
+    ]
+    recent = dict.fromkeys(
+        recipe_id for recipe_id in chain.from_iterable(zip_longest(*latest))
+        if recipe_id is not None
+    )
+    return list(recent)[:MAX_SEEDS]
+
+
+def rank_for_user(user_id, state):
+    seeds = state['favorites'] | state['cart']
+    recent = recent_seeds(user_id, seeds)
+    scores = combine(
+        RecipeSimilarity.objects.filter(
+            recipe_id__in=recent
+        ).values_list('similar_id', 'score'),
+        seeds
+    )
+    authors = dict(Recipe.objects.filter(
+        pk__in=list(scores)
+    ).values_list('pk', 'author_id'))
+    ranked = sorted(
+        (
+            (score + FOLLOW_BONUS * (authors[pk] in state['follows']), pk)
+            for pk, score in scores.items()
+            if pk in authors and authors[pk] != user_id
+        ),
+        reverse=True
+    )
+    ids = [pk for _, pk in ranked[:RECOMMENDATIONS_SIZE]]
+    if len(ids) < RECOMMENDATIONS_SIZE:
+        ids += popular(
+            seeds | set(ids), user_id, RECOMMENDATIONS_SIZE - len(ids)
+        )
+    return ids
+
+
+def recommended_ids(request):
+    """id рекомендованных рецептов, от лучших к худшим.
+
+    Список считается по похожим рецептам из RecipeSimilarity, а если их
+    не хватает - дополняется популярными, и кэшируется на
+    RECOMMENDATIONS_TIMEOUT секунд. Уже сохранённые рецепты отсеиваются
+    при каждом запросе.
+    """
+    if not request.user.is_authenticated:
+        key = 'recommendations:popular'
+        ids = cache.get(key)
+        if ids is None:
+            ids = popular((), None, RECOMMENDATIONS_SIZE)
+            cache.set(key, ids, settings.RECOMMENDATIONS_TIMEOUT)
+        return ids
+    state = get_user_state(request)
+    key = f'recommendations:{request.user.pk}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = rank_for_user(request.user.pk, state)
+        cache.set(key, ids, settings.RECOMMENDATIONS_TIMEOUT)
+    seen = state['favorites'] | state['cart']
+    return [pk for pk in ids if pk not in seen]
@@ -0,0 +1,111 @@
+import re
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import IngredientRecipe, Recipe
+
+CONFIG = 'russian'
+FTS_TABLE = 'api_recipe_fts'
+# Веса колонок FTS5 в bm25: название, ингредиенты, описание.
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+FTS_INSERT = f'''
+    INSERT INTO {FTS_TABLE}(rowid, name, ingredients, text)
+    SELECT r.id, r.name, coalesce((
+        SELECT group_concat(i.name, ' ')
+        FROM api_ingredientrecipe ir
+        JOIN api_ingredient i ON i.id = ir.ingredient_id
+        WHERE ir.recipe_id = r.id
+    ), ''), r.text
+    FROM api_recipe r
+'''
+
+
+def ingredient_names():
+    return Coalesce(
+        Subquery(
+            IngredientRecipe.objects.filter(recipe=OuterRef('pk'))
+            .order_by()
+            .values('recipe')
+            .annotate(names=StringAgg('ingredient__name', delimiter=' '))
+            .values('names')
+        ),
+        Value('')
+    )
+
+
+def search_vector():
+    return (
+        SearchVector('name', weight='A', config=CONFIG)
+        + SearchVector(ingredient_names(), weight='B', config=CONFIG)
+        + SearchVector('text', weight='C', config=CONFIG)
+    )
+
+
+def in_clause(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def update_search_vector(recipe_ids):
+    """Обновляет поисковый индекс рецептов после изменения."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    if connection.vendor == 'postgresql':
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            search_vector=search_vector()
+        )
+    elif connection.vendor == 'sqlite':
+        remove_from_index(recipe_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{FTS_INSERT} WHERE r.id IN ({in_clause(recipe_ids)})',
+                recipe_ids
+            )
+
+
+def remove_from_index(recipe_ids):
+    if connection.vendor == 'sqlite' and recipe_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} '
+                f'WHERE rowid IN ({in_clause(recipe_ids)})',
+                list(recipe_ids)
+            )
+
+
+def fts_query(value):
+    """Превращает ввод пользователя в запрос FTS5: все слова по префиксу."""
+    words = re.findall(r'\w+', value)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search(queryset, value):
+    """Рецепты, подходящие под запрос, от более релевантных к менее."""
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(value, config=CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        )
+    elif connection.vendor == 'sqlite':
+        query = fts_query(value)
+        if not query:
+            return queryset
+        weights = ', '.join(map(str, FTS_WEIGHTS))
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (query,)
+        )).annotate(rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = api_recipe.id',
+            (query,)
+        ))
+    else:
+        return queryset.filter(name__icontains=value)
+    return queryset.order_by('-rank', '-pub_date', '-id')
@@ -1,15 +1,20 @@
-import base64
+import binascii
+from functools import partial
 
 import webcolors
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.shortcuts import get_object_or_404
+from django.db import transaction
 from rest_framework import serializers
 from users.models import Follow, User
 from users.serializers import CurrentUserSerializer
 
-from .models import (FavoriteRecipe, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
+from . import cart, search, tasks
+from .cookable import cookable_index
+from .images import (decode_base64, make_thumbnails, release_image,
+                     thumbnail_urls)
+from .models import Ingredient, IngredientRecipe, Recipe, Tag
+from .user_state import get_user_state
 
 
 class Base64ImageField(serializers.ImageField):
@@ -17,10 +22,49 @@ class Base64ImageField(serializers.ImageField):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                data = decode_base64(imgstr, ext)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
         return super().to_internal_value(data)
 
 
+class ThumbnailsField(serializers.ReadOnlyField):
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value.image:
+            return None
+        urls = thumbnail_urls(value)
+        request = self.context.get('request')
+        if request is not None:
+            urls = {
+                size: request.build_absolute_uri(url)
+                for size, url in urls.items()
+            }
+        return urls
+
+
+class IdListSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_IDS
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+
+class CookableSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+
+
 class HexToNameColor(serializers.Field):
     def to_representation(self, value):
         return value
@@ -90,43 +134,93 @@ class RecipePostSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart', 'name', 'image', 'text',
                   'cooking_time')
 
-    def add_ingredients(self, recipe, ingredients):
-        for ingredient in ingredients:
-            ingredient_id = ingredient.get("id")
-            amount = ingredient.get("amount")
-            IngredientRecipe.objects.create(
-                ingredient_id=ingredient_id,
-                amount=amount,
-                recipe=recipe
+    def validate_ingredients(self, value):
+        ids = [ingredient['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты в рецепте не должны повторяться'
+            )
+        found = set(Ingredient.objects.filter(
+            pk__in=ids
+        ).values_list('pk', flat=True))
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'Нет ингредиентов с id: {", ".join(map(str, missing))}'
             )
+        return value
 
+    def set_ingredients(self, recipe, ingredients, created=False):
+        amounts = {
+            ingredient.get('id'): ingredient.get('amount')
+            for ingredient in ingredients
+        }
+        current = {} if created else {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        removed = [
+            row.id for ingredient_id, row in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        new = []
+        for ingredient_id, amount in amounts.items():
+            row = current.get(ingredient_id)
+            if row is None:
+                new.append(IngredientRecipe(
+                    ingredient_id=ingredient_id,
+                    amount=amount,
+                    recipe=recipe
+                ))
+            elif row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            IngredientRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        if new:
+            IngredientRecipe.objects.bulk_create(new)
+        if removed or new:
+            transaction.on_commit(partial(
+                cookable_index.recipe_changed, recipe.pk
+            ))
+        if not created and (removed or changed or new):
+            cart.recipe_ingredients_changed(recipe, {
+                ingredient_id for ingredient_id in current
+                if ingredient_id not in amounts
+            } | {row.ingredient_id for row in changed + new})
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        self.add_ingredients(recipe, ingredients)
-        for tag in tags:
-            recipe.tags.add(get_object_or_404(Tag, pk=tag.id))
-        recipe.save()
+        self.set_ingredients(recipe, ingredients, created=True)
+        recipe.tags.set(tags)
+        search.update_search_vector([recipe.pk])
+        tasks.submit(make_thumbnails, recipe.image.name)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time',
-            instance.cooking_time
-        )
-        instance.tags.clear()
-        instance.ingredients.clear()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        for tag in tags:
-            instance.tags.add(get_object_or_404(Tag, pk=tag.id))
-        self.add_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            self.set_ingredients(instance, ingredients)
+        if tags is not None:
+            instance.tags.set(tags)
+        old_image = instance.image.name
+        if 'image' in validated_data:
+            validated_data['has_thumbnails'] = False
+        instance = super().update(instance, validated_data)
+        search.update_search_vector([instance.pk])
+        if 'image' in validated_data:
+            tasks.submit(make_thumbnails, instance.image.name)
+        if instance.image.name != old_image:
+            tasks.submit(release_image, old_image)
+        return instance
 
 
 class RecipeGetSerializer(serializers.ModelSerializer):
@@ -140,34 +234,33 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         many=True
     )
     image = Base64ImageField()
+    image_thumb = ThumbnailsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'image_thumb',
+                  'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
         request = self.context.get("request")
         if not request.user.is_authenticated:
             return False
-        return FavoriteRecipe.objects.filter(
-            user=request.user, recipe=obj
-        ).exists()
+        return obj.id in get_user_state(request)['favorites']
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get("request")
         if not request.user.is_authenticated:
             return False
-        return ShoppingCart.objects.filter(
-            user=request.user, recipe=obj
-        ).exists()
+        return obj.id in get_user_state(request)['cart']
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
+    image_thumb = ThumbnailsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_thumb', 'cooking_time')
 
 
 class SubscriptionsSerializer(serializers.ModelSerializer):
@@ -178,7 +271,7 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
 
     class Meta:
         model = Follow
@@ -186,28 +279,17 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        recipes = Recipe.objects.filter(author=obj.author)
-        recipes_limit = self.context['request'].query_params.get(
-            'recipes_limit'
-        )
-        if recipes_limit:
-            return ShortRecipeSerializer(
-                recipes[:int(recipes_limit)],
-                many=True
-            ).data
-        return ShortRecipeSerializer(recipes, many=True).data
-
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj.author)
-        return recipes.count()
+        return ShortRecipeSerializer(
+            obj.author.recent_recipes,
+            many=True
+        ).data
 
     def get_is_subscribed(self, obj):
-        return CurrentUserSerializer.get_is_subscribed(self, obj.author)
+        return True
 
 
 class IsSubscribeSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -215,15 +297,12 @@ class IsSubscribeSerializer(serializers.ModelSerializer):
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed',
                   'recipes', 'recipes_count')
+        read_only_fields = ('recipes_count',)
 
     def get_recipes(self, obj):
         recipes = Recipe.objects.filter(author_id=obj.id)
         serializer = ShortRecipeSerializer(recipes, many=True)
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author_id=obj.id)
-        return recipes.count()
-
     def get_is_subscribed(self, obj):
         return True
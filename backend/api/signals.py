@@ -0,0 +1,93 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from users.models import User
+
+from . import cart, search, tasks, timeline
+from .cache import bump_version
+from .cookable import VERSION_GROUP, cookable_index
+from .counters import bump
+from .images import release_image
+from .ingredient_index import ingredient_index
+from .models import Ingredient, Recipe, Tag
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version('ingredients')
+    ingredient_index.invalidate()
+
+
+@receiver(post_delete, sender=Ingredient)
+def invalidate_cookable(**kwargs):
+    bump_version(VERSION_GROUP)
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(instance, created, **kwargs):
+    if not created:
+        search.update_search_vector(Recipe.objects.filter(
+            ingredients=instance
+        ).values_list('pk', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version('tags')
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_image(instance, **kwargs):
+    tasks.submit(release_image, instance.image.name)
+    search.remove_from_index([instance.pk])
+    transaction.on_commit(partial(
+        cookable_index.recipe_changed, instance.pk
+    ))
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_author(instance, raw, **kwargs):
+    """Запоминает прежнего автора: его могут сменить в админке."""
+    if raw or instance._state.adding:
+        return
+    instance._previous_author_id = Recipe.objects.filter(
+        pk=instance.pk
+    ).values_list('author_id', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def count_author_recipes(instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        bump(User.objects.filter(pk=instance.author_id), 'recipes_count')
+        return
+    previous = getattr(instance, '_previous_author_id', None)
+    if previous is not None and previous != instance.author_id:
+        bump(User.objects.filter(pk=previous), 'recipes_count', -1)
+        bump(User.objects.filter(pk=instance.author_id), 'recipes_count')
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(instance, created, raw, **kwargs):
+    """Разносит новый рецепт по лентам, откуда бы он ни был создан."""
+    if created and not raw:
+        tasks.submit(timeline.fan_out, instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_recipe_carts(instance, **kwargs):
+    """Запоминает затронутые списки покупок до каскадного удаления."""
+    instance._cart_changes = (
+        cart.cart_users(instance.pk),
+        cart.recipes_ingredients([instance.pk])
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def update_recipe_author_and_carts(instance, **kwargs):
+    bump(User.objects.filter(pk=instance.author_id), 'recipes_count', -1)
+    cart.refresh(*getattr(instance, '_cart_changes', ((), ())))
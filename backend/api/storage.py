@@ -0,0 +1,85 @@
+import hashlib
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файлы под именем из SHA-256 их содержимого.
+
+    Одинаковые загрузки попадают в один файл, а содержимое по
+    конкретному пути никогда не меняется, поэтому его можно
+    кэшировать навсегда (см. infra/nginx.conf).
+    """
+    prefix = 'recipes'
+    # Сколько секунд после загрузки файл считается используемым, даже
+    # если ни один сохранённый рецепт на него ещё не ссылается: рецепт
+    # появляется в базе только после завершения транзакции запроса.
+    reuse_period = 15 * 60
+    hashed_name = re.compile(r'[0-9a-f]{64}(\.[0-9a-z]+)?')
+    temporary_name = re.compile(
+        r'[0-9a-f]{64}(\.[0-9a-z]+)?\.[0-9a-f]{32}\.tmp'
+    )
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    @contextmanager
+    def lock(self):
+        """Блокировка между процессами для проверки и удаления файлов."""
+        directory = self.path(self.prefix)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '.lock'), 'a') as file:
+            locks.lock(file, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(file)
+
+    def recently_saved(self, name):
+        try:
+            modified = os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return time.time() - modified < self.reuse_period
+
+    def stored_names(self):
+        """Имена файлов по хэшу и недописанных временных файлов."""
+        if not self.exists(self.prefix):
+            return
+        directories, _ = self.listdir(self.prefix)
+        for directory in sorted(directories):
+            _, files = self.listdir(f'{self.prefix}/{directory}')
+            for file in sorted(files):
+                if file.startswith(directory) and (
+                        self.hashed_name.fullmatch(file)
+                        or self.temporary_name.fullmatch(file)):
+                    yield f'{self.prefix}/{directory}/{file}'
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        name = f'{self.prefix}/{digest[:2]}/{digest}{ext}'
+        with self.lock():
+            if self.exists(name):
+                # Продлевает жизнь файла: release_image его не удалит.
+                os.utime(self.path(name))
+                return name
+        # Файл появляется под итоговым именем целиком и сразу.
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            # Такое же содержимое успели сохранить параллельно.
+            pass
+        finally:
+            os.remove(self.path(temporary))
+        return name
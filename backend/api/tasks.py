@@ -0,0 +1,26 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.BACKGROUND_WORKERS,
+    thread_name_prefix='background'
+)
+
+
+def run(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой', func)
+    finally:
+        connections.close_all()
+
+
+def submit(func, *args):
+    """Выполняет функцию в фоновом потоке после фиксации транзакции."""
+    transaction.on_commit(lambda: executor.submit(run, func, *args))
@@ -0,0 +1,864 @@
+import base64
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import combinations, count
+from unittest import mock
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from PIL import Image
+from rest_framework.test import APIClient
+from users.models import Follow, User
+
+from . import cart, tasks
+from .cookable import CookableIndex
+from .counters import COUNTERS
+from .counters import drift as counter_drift
+from .filters import Filter
+from .images import sweep_images, thumbnail_name
+from .models import (FavoriteRecipe, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCart, ShoppingCartIngredient, Tag, TimelineEntry)
+
+# Название рецепта уникально у автора.
+RECIPE_NUMBERS = count()
+
+
+def create_recipes(author, number, tags=(), ingredients=()):
+    recipes = []
+    for _ in range(number):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=f'Рецепт {next(RECIPE_NUMBERS)}',
+            text='Описание',
+            image='recipes/test.png',
+            cooking_time=10,
+        )
+        recipe.tags.set(tags)
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        ])
+        recipes.append(recipe)
+    return recipes
+
+
+def counters_drift():
+    """Счётчики, разошедшиеся с реальным количеством строк."""
+    return [
+        (model.__name__, field, pk)
+        for model, field, source, fk in COUNTERS
+        for pk in counter_drift(model, field, source, fk).values_list(
+            'pk', flat=True
+        )
+    ]
+
+
+def image_data(size=8):
+    buffer = BytesIO()
+    Image.new('RGB', (size, size)).save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        tags = [
+            Tag.objects.create(name='Завтрак', color='#E26C2D',
+                               slug='breakfast'),
+            Tag.objects.create(name='Обед', color='#49B64E', slug='lunch'),
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        create_recipes(cls.author, 12, tags, ingredients)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_list_queries(self, client, limit, queries):
+        if connection.vendor == 'postgresql':
+            # Перед COUNT(*) без фильтров - оценка из pg_class.
+            queries += 1
+        with self.assertNumQueries(queries):
+            response = client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        # COUNT, рецепты с авторами, теги, ингредиенты.
+        for limit in (2, 10):
+            cache.clear()
+            self.assert_list_queries(self.client, limit, 4)
+
+    def test_authenticated(self):
+        # Плюс избранное, список покупок и подписки - один раз за кэш.
+        self.client.force_authenticate(self.author)
+        for limit in (2, 10):
+            cache.clear()
+            self.assert_list_queries(self.client, limit, 7)
+
+    def test_cursor_ignored_with_search(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=2')
+        self.assertNotIn('count', response.data)
+        response = self.client.get(
+            '/api/recipes/?cursor=&limit=2&search=рецепт'
+        )
+        self.assertIn('count', response.data)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeWriteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                      slug='breakfast')
+        self.flour = Ingredient.objects.create(name='мука',
+                                               measurement_unit='г')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def post_recipe(self, ingredients, image=None):
+        return self.client.post('/api/recipes/', {
+            'tags': [self.tag.pk],
+            'ingredients': ingredients,
+            'name': 'Блины',
+            'image': image or image_data(),
+            'text': 'Описание',
+            'cooking_time': 10,
+        }, format='json')
+
+    def test_create(self):
+        response = self.post_recipe([{'id': self.flour.pk, 'amount': 200}])
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_wrapped_base64_image(self):
+        buffer = BytesIO()
+        Image.frombytes('RGB', (200, 200), os.urandom(200 * 200 * 3)).save(
+            buffer, 'PNG'
+        )
+        self.assertGreater(len(buffer.getvalue()), 64 * 1024)
+        encoded = base64.encodebytes(buffer.getvalue()).decode()
+        response = self.post_recipe(
+            [{'id': self.flour.pk, 'amount': 200}],
+            image=f'data:image/png;base64,{encoded}'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_duplicate_ingredients(self):
+        response = self.post_recipe([
+            {'id': self.flour.pk, 'amount': 200},
+            {'id': self.flour.pk, 'amount': 100},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+
+    def test_unknown_ingredient(self):
+        response = self.post_recipe([{'id': self.flour.pk + 100,
+                                      'amount': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_sweep_images(self):
+        storage = Recipe._meta.get_field('image').storage
+        used = storage.save('used.png', ContentFile(b'used'))
+        orphan = storage.save('orphan.png', ContentFile(b'orphan'))
+        recent = storage.save('recent.png', ContentFile(b'recent'))
+        abandoned = f'{orphan}.{"0" * 32}.tmp'
+        with open(storage.path(abandoned), 'wb') as file:
+            file.write(b'orphan')
+        thumbnail = default_storage.save(thumbnail_name(orphan, 'small'),
+                                         ContentFile(b'thumbnail'))
+        recipe, = create_recipes(self.author, 1)
+        Recipe.objects.filter(pk=recipe.pk).update(image=used)
+        old = time.time() - storage.reuse_period - 1
+        for name in (used, orphan, abandoned):
+            os.utime(storage.path(name), (old, old))
+
+        self.assertEqual(sweep_images(), 2)
+        self.assertTrue(storage.exists(used))
+        self.assertTrue(storage.exists(recent))
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(storage.exists(abandoned))
+        self.assertFalse(default_storage.exists(thumbnail))
+
+
+def walk_cursor(client, url):
+    """Проходит все страницы по ссылкам next; возвращает id по порядку."""
+    ids = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200, response.data
+        ids += [item['id'] for item in response.data['results']]
+        url = response.data['next']
+        if url:
+            parts = urlsplit(url)
+            url = f'{parts.path}?{parts.query}'
+    return ids
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        create_recipes(self.author, 7)
+        self.client = APIClient()
+
+    def expected(self):
+        return list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', flat=True))
+
+    def test_walk_without_duplicates_or_gaps(self):
+        ids = walk_cursor(self.client, '/api/recipes/?cursor=&limit=3')
+        self.assertEqual(ids, self.expected())
+
+    def test_ties_on_pub_date(self):
+        Recipe.objects.update(pub_date=Recipe.objects.first().pub_date)
+        ids = walk_cursor(self.client, '/api/recipes/?cursor=&limit=2')
+        self.assertEqual(ids, self.expected())
+
+    def test_insert_does_not_shift_pages(self):
+        expected = self.expected()
+        response = self.client.get('/api/recipes/?cursor=&limit=3')
+        served = [item['id'] for item in response.data['results']]
+        create_recipes(self.author, 1)
+        parts = urlsplit(response.data['next'])
+        rest = walk_cursor(self.client, f'{parts.path}?{parts.query}')
+        self.assertEqual(served + rest, expected)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'WyIxIl0='):
+            response = self.client.get(f'/api/recipes/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_subscriptions(self):
+        user = User.objects.create(username='user', email='user@example.com')
+        authors = [self.author] + [
+            User.objects.create(username=f'author{number}',
+                                email=f'author{number}@example.com')
+            for number in range(4)
+        ]
+        for author in authors:
+            Follow.objects.create(user=user, author=author)
+        self.client.force_authenticate(user)
+        ids = walk_cursor(
+            self.client, '/api/users/subscriptions/?cursor=&limit=2'
+        )
+        self.assertEqual(ids, [author.pk for author in authors])
+
+
+class IngredientCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Ingredient.objects.create(name='абрикосы', measurement_unit='г')
+
+    def test_search_is_cached_with_etag(self):
+        client = APIClient()
+        response = client.get('/api/ingredients/?name=аб')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        with self.assertNumQueries(0):
+            response = client.get(
+                '/api/ingredients/?name=аб',
+                HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_change_invalidates_cache(self):
+        client = APIClient()
+        client.get('/api/ingredients/?name=аб')
+        Ingredient.objects.create(name='абрикосовый сок', measurement_unit='г')
+        response = client.get('/api/ingredients/?name=аб')
+        self.assertEqual(len(response.json()), 2)
+
+
+class RecipeSignalsTest(TestCase):
+    """Счётчики и списки покупок обновляются при любом создании и
+    удалении рецепта, в том числе из админки."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+
+    def test_recipes_count(self):
+        recipes = create_recipes(self.author, 2)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+        recipes[0].delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_author_change(self):
+        other = User.objects.create(username='other', email='o@example.com')
+        recipe = create_recipes(self.author, 1)[0]
+        recipe.author = other
+        recipe.save()
+        self.author.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(
+            (self.author.recipes_count, other.recipes_count), (0, 1)
+        )
+
+    def test_staff_update_keeps_author(self):
+        staff = User.objects.create(
+            username='staff', email='staff@example.com', is_staff=True
+        )
+        recipe = create_recipes(self.author, 1)[0]
+        client = APIClient()
+        client.force_authenticate(staff)
+        response = client.patch(
+            f'/api/recipes/{recipe.pk}/', {'name': 'Другое название'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.author, self.author)
+        self.assertFalse(counters_drift())
+
+    def test_other_user_cannot_update(self):
+        other = User.objects.create(username='other', email='o@example.com')
+        recipe = create_recipes(self.author, 1)[0]
+        client = APIClient()
+        client.force_authenticate(other)
+        response = client.patch(
+            f'/api/recipes/{recipe.pk}/', {'name': 'Чужой'}, format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_delete_refreshes_carts(self):
+        recipe = create_recipes(
+            self.author, 1, ingredients=[self.ingredient]
+        )[0]
+        client = APIClient()
+        client.force_authenticate(self.author)
+        client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertTrue(ShoppingCartIngredient.objects.exists())
+        recipe.delete()
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+
+
+class CookableIndexTest(TestCase):
+    """Индекс другого процесса догоняет изменения по журналу."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.flour, self.milk = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'молоко')
+        ]
+        self.recipe = create_recipes(author, 1, ingredients=[self.flour])[0]
+
+    def test_changes_are_applied_without_rebuild(self):
+        writer, reader = CookableIndex(), CookableIndex()
+        self.assertEqual(reader.rank([self.milk.pk]), [])
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.milk, amount=1
+        )
+        writer.recipe_changed(self.recipe.pk)
+        # Только ингредиенты изменённого рецепта, без полной перестройки.
+        with self.assertNumQueries(1):
+            ranked = reader.rank([self.milk.pk])
+        self.assertEqual(ranked, [(self.recipe.pk, 0.5, 1)])
+        recipe_id = self.recipe.pk
+        self.recipe.delete()
+        writer.recipe_changed(recipe_id)
+        self.assertEqual(reader.rank([self.flour.pk]), [])
+
+
+class FollowAdminTest(TestCase):
+    def test_delete_updates_counter_and_timeline(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin'
+        )
+        author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        client.post(f'/api/users/{author.pk}/subscribe/')
+        follow = Follow.objects.get()
+        self.client.force_login(admin)
+        response = self.client.post(
+            f'/admin/users/follow/{follow.pk}/delete/', {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(counters_drift())
+
+
+class BatchEndpointsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.recipes = create_recipes(self.author, 3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, url, ids):
+        response = getattr(self.client, method)(
+            url, {'ids': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(counters_drift(), [])
+        return {
+            item['id']: item['status'] for item in response.data['results']
+        }
+
+    def favorites_counts(self):
+        return list(Recipe.objects.order_by('pk').values_list(
+            'favorites_count', flat=True
+        ))
+
+    def test_recipe_batches(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        unknown = third + 100
+        for url, model, field in (
+            ('/api/recipes/favorite/batch/', FavoriteRecipe,
+             'favorites_count'),
+            ('/api/recipes/shopping_cart/batch/', ShoppingCart,
+             'shopping_cart_count'),
+        ):
+            with self.subTest(url=url):
+                self.batch('post', url, [first])
+                self.assertEqual(
+                    self.batch('post', url, [first, second, second, unknown]),
+                    {first: 'exists', second: 'created', unknown: 'not_found'}
+                )
+                self.assertEqual(
+                    list(Recipe.objects.order_by('pk').values_list(
+                        field, flat=True
+                    )),
+                    [1, 1, 0]
+                )
+                self.assertEqual(
+                    self.batch('delete', url, [second, third, third, unknown]),
+                    {second: 'deleted', third: 'missing',
+                     unknown: 'not_found'}
+                )
+                self.assertEqual(
+                    list(Recipe.objects.order_by('pk').values_list(
+                        field, flat=True
+                    )),
+                    [1, 0, 0]
+                )
+                self.assertEqual(
+                    list(model.objects.values_list('recipe_id', flat=True)),
+                    [first]
+                )
+
+    def test_subscribe_batch(self):
+        url = '/api/users/subscribe/batch/'
+        unknown = self.author.pk + 100
+        self.assertEqual(
+            self.batch('post', url, [self.author.pk, self.user.pk, unknown]),
+            {self.author.pk: 'created', self.user.pk: 'forbidden',
+             unknown: 'not_found'}
+        )
+        self.assertEqual(
+            self.batch('post', url, [self.author.pk, self.author.pk]),
+            {self.author.pk: 'exists'}
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(
+            self.batch('delete', url, [self.author.pk, self.user.pk]),
+            {self.author.pk: 'deleted', self.user.pk: 'missing'}
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_duplicates_answered_once(self):
+        first = self.recipes[0].pk
+        response = self.client.post(
+            '/api/recipes/favorite/batch/', {'ids': [first] * 3},
+            format='json'
+        )
+        self.assertEqual(response.data['results'],
+                         [{'id': first, 'status': 'created'}])
+        self.assertEqual(self.favorites_counts(), [1, 0, 0])
+
+    def test_max_ids(self):
+        url = '/api/recipes/favorite/batch/'
+        pks = [recipe.pk for recipe in self.recipes]
+        ids = pks + list(range(
+            pks[-1] + 1, pks[-1] + settings.BATCH_MAX_IDS - len(pks) + 2
+        ))
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', response.data)
+        self.assertFalse(FavoriteRecipe.objects.exists())
+        self.assertEqual(
+            len(self.batch('post', url, ids[:-1])), settings.BATCH_MAX_IDS
+        )
+        self.assertEqual(self.favorites_counts(), [1, 1, 1])
+
+
+class ShoppingCartAggregationTest(TestCase):
+    download_url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.flour, self.milk, self.eggs = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('молоко', 'мл'),
+                               ('яйца', 'шт'))
+        )
+        self.first, self.second = create_recipes(
+            self.author, 2, ingredients=(self.flour, self.milk)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def cart_amounts(self):
+        self.assertEqual(cart.drift(), set())
+        response = self.client.get(self.download_url, {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        return {item['name']: item['amount'] for item in response.data}
+
+    def edit_first(self, ingredients):
+        response = self.client.patch(
+            f'/api/recipes/{self.first.pk}/',
+            {'ingredients': ingredients}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_single_and_batch(self):
+        response = self.client.post(
+            f'/api/recipes/{self.first.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.cart_amounts(), {'мука': 1, 'молоко': 1})
+        self.client.post('/api/recipes/shopping_cart/batch/',
+                         {'ids': [self.first.pk, self.second.pk]},
+                         format='json')
+        self.assertEqual(self.cart_amounts(), {'мука': 2, 'молоко': 2})
+        response = self.client.delete(
+            f'/api/recipes/{self.first.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.cart_amounts(), {'мука': 1, 'молоко': 1})
+        self.client.delete('/api/recipes/shopping_cart/batch/',
+                           {'ids': [self.second.pk]}, format='json')
+        self.assertEqual(self.cart_amounts(), {})
+
+    def test_recipe_edit(self):
+        self.client.post('/api/recipes/shopping_cart/batch/',
+                         {'ids': [self.first.pk, self.second.pk]},
+                         format='json')
+        self.edit_first([{'id': self.flour.pk, 'amount': 5},
+                         {'id': self.eggs.pk, 'amount': 3}])
+        self.assertEqual(self.cart_amounts(),
+                         {'мука': 6, 'молоко': 1, 'яйца': 3})
+        self.edit_first([{'id': self.milk.pk, 'amount': 2}])
+        self.assertEqual(self.cart_amounts(), {'мука': 1, 'молоко': 3})
+
+    def test_formats(self):
+        self.client.post(f'/api/recipes/{self.first.pk}/shopping_cart/')
+        response = self.client.get(self.download_url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(
+            b''.join(response.streaming_content).decode().splitlines(),
+            ['Ингредиент,Единица измерения,Количество',
+             'молоко,мл,1', 'мука,г,1']
+        )
+        response = self.client.get(self.download_url, {'format': 'json'})
+        self.assertEqual(response.json(), [
+            {'amount': 1, 'name': 'молоко', 'measurement_unit': 'мл'},
+            {'amount': 1, 'name': 'мука', 'measurement_unit': 'г'},
+        ])
+
+    def test_etag_changes_after_edit(self):
+        self.client.post(f'/api/recipes/{self.first.pk}/shopping_cart/')
+        response = self.client.get(self.download_url, {'format': 'json'})
+        etag = response['ETag']
+        response = self.client.get(self.download_url, {'format': 'json'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(
+            self.client.get(self.download_url, {'format': 'csv'})['ETag'],
+            etag
+        )
+        self.edit_first([{'id': self.flour.pk, 'amount': 5}])
+        response = self.client.get(self.download_url, {'format': 'json'},
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.cart_amounts(), {'мука': 5})
+
+
+def run_now(func, *args):
+    """Фоновая задача выполняется сразу, в транзакции теста."""
+    func(*args)
+
+
+@mock.patch.object(tasks, 'submit', run_now)
+class TimelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        self.author, self.other = (
+            User.objects.create(username=name, email=f'{name}@example.com')
+            for name in ('author', 'other')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def timeline(self):
+        return set(TimelineEntry.objects.filter(
+            user=self.user
+        ).values_list('recipe_id', flat=True))
+
+    def subscribe(self, author):
+        response = self.client.post(f'/api/users/{author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_fan_out(self):
+        self.subscribe(self.author)
+        recipe, = create_recipes(self.author, 1)
+        create_recipes(self.other, 1)
+        self.assertEqual(self.timeline(), {recipe.pk})
+
+    def test_backfill_on_subscribe(self):
+        recipes = (create_recipes(self.author, 2)
+                   + create_recipes(self.other, 2))
+        self.subscribe(self.author)
+        self.assertEqual(self.timeline(),
+                         {recipe.pk for recipe in recipes[:2]})
+        self.client.post('/api/users/subscribe/batch/',
+                         {'ids': [self.other.pk]}, format='json')
+        self.assertEqual(self.timeline(), {recipe.pk for recipe in recipes})
+
+    def test_unsubscribe(self):
+        create_recipes(self.author, 2)
+        others = create_recipes(self.other, 2)
+        self.client.post('/api/users/subscribe/batch/',
+                         {'ids': [self.author.pk, self.other.pk]},
+                         format='json')
+        response = self.client.delete(
+            f'/api/users/{self.author.pk}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.timeline(), {recipe.pk for recipe in others})
+        self.client.delete('/api/users/subscribe/batch/',
+                           {'ids': [self.other.pk]}, format='json')
+        self.assertEqual(self.timeline(), set())
+
+    def test_feed_cursor(self):
+        self.subscribe(self.author)
+        self.subscribe(self.other)
+        create_recipes(self.author, 4)
+        create_recipes(self.other, 3)
+        create_recipes(self.user, 1)
+        expected = list(Recipe.objects.exclude(author=self.user).order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', flat=True))
+        self.assertEqual(
+            walk_cursor(self.client, '/api/recipes/feed/?limit=3'), expected
+        )
+        # Рецепты «знаменитостей» читаются из таблицы рецептов.
+        with self.settings(TIMELINE_FANOUT_LIMIT=0):
+            TimelineEntry.objects.all().delete()
+            self.assertEqual(
+                walk_cursor(self.client, '/api/recipes/feed/?limit=3'),
+                expected
+            )
+
+
+class FilterQueryPlanTest(TestCase):
+    """Ни одна комбинация фильтров не читает таблицы целиком.
+
+    Сортировка допустима только для строк, выбранных по первичному ключу
+    или поисковому индексу: их не больше, чем рецептов в избранном,
+    списке покупок или результатах поиска.
+    """
+
+    PARAMS = {
+        'author': None,
+        'tags': ['breakfast', 'lunch'],
+        'is_favorited': '1',
+        'is_in_shopping_cart': '1',
+        'search': 'рецепт',
+    }
+    # Полный просмотр таблицы, сортировка и ограниченная выборка рецептов
+    # в тексте EXPLAIN каждой СУБД.
+    PLAN_PATTERNS = {
+        'sqlite': {
+            # Виртуальные таблицы полнотекстового поиска читаются
+            # своим индексом.
+            'scan': r'\bSCAN (?!.*\b(USING|VIRTUAL TABLE)\b)',
+            'sort': r'\bUSE TEMP B-TREE\b',
+            'bounded': r'\bSEARCH api_recipe .*\browid=\?',
+        },
+        'postgresql': {
+            'scan': r'\bSeq Scan on\b',
+            'sort': r'\bSort\b',
+            'bounded': (
+                r'\b(Index Scan using|Bitmap Index Scan on) '
+                r'(api_recipe_pkey|recipe_search_vector_idx)\b'
+            ),
+        },
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        tags = [
+            Tag.objects.create(name='Завтрак', color='#E26C2D',
+                               slug='breakfast'),
+            Tag.objects.create(name='Обед', color='#49B64E', slug='lunch'),
+        ]
+        recipes = create_recipes(cls.user, 6, tags)
+        FavoriteRecipe.objects.bulk_create([
+            FavoriteRecipe(user=cls.user, recipe=recipe)
+            for recipe in recipes[:3]
+        ])
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[2:5]
+        ])
+
+    def setUp(self):
+        patterns = self.PLAN_PATTERNS.get(connection.vendor)
+        if patterns is None:
+            self.skipTest(f'Нет шаблонов EXPLAIN для {connection.vendor}')
+        self.patterns = {
+            name: re.compile(pattern) for name, pattern in patterns.items()
+        }
+        if connection.vendor == 'postgresql':
+            # На нескольких строках планировщик честно выбирает Seq Scan;
+            # так он берёт его, только когда подходящего индекса нет.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        cache.clear()
+
+    def get_plan(self, params):
+        request = RequestFactory().get('/api/recipes/', params)
+        request.user = self.user
+        filterset = Filter(
+            request.GET, queryset=Recipe.objects.with_related(),
+            request=request
+        )
+        return filterset.qs.explain()
+
+    def test_filter_combinations(self):
+        params = dict(self.PARAMS, author=str(self.user.pk))
+        for size in range(len(params) + 1):
+            for names in combinations(params, size):
+                with self.subTest(filters=names):
+                    plan = self.get_plan({name: params[name]
+                                          for name in names})
+                    self.assertIsNone(self.patterns['scan'].search(plan),
+                                      plan)
+                    if self.patterns['sort'].search(plan):
+                        self.assertIsNotNone(
+                            self.patterns['bounded'].search(plan), plan
+                        )
+
+
+class ConcurrentToggleTest(TransactionTestCase):
+    """Повторные нажатия из параллельных запросов не дают ошибок 500."""
+
+    THREADS = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Общий кэш базы в памяти не ждёт блокировку, а сразу
+            # возвращает ошибку; нужна файловая база (DB_TEST_NAME).
+            self.skipTest('SQLite в памяти не держит параллельную запись')
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        self.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        self.recipe = create_recipes(self.author, 1)[0]
+
+    def request(self, method, url):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            return getattr(client, method)(url).status_code
+        finally:
+            connection.close()
+
+    def hammer(self, method, url):
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            return list(executor.map(
+                lambda _: self.request(method, url), range(self.THREADS)
+            ))
+
+    def assert_toggle(self, url, get_counter):
+        codes = self.hammer('post', url)
+        self.assertNotIn(500, codes)
+        self.assertEqual(codes.count(201), 1, codes)
+        self.assertEqual(get_counter(), 1)
+        codes = self.hammer('delete', url)
+        self.assertNotIn(500, codes)
+        self.assertEqual(codes.count(204), 1, codes)
+        self.assertEqual(get_counter(), 0)
+
+    def test_favorite(self):
+        self.assert_toggle(
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            lambda: Recipe.objects.get(pk=self.recipe.pk).favorites_count
+        )
+
+    def test_shopping_cart(self):
+        self.assert_toggle(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            lambda: Recipe.objects.get(pk=self.recipe.pk).shopping_cart_count
+        )
+
+    def test_subscribe(self):
+        self.assert_toggle(
+            f'/api/users/{self.author.pk}/subscribe/',
+            lambda: User.objects.get(pk=self.author.pk).followers_count
+        )
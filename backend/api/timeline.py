@@ -0,0 +1,136 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Subquery
+from users.models import Follow, User
+
+from . import tasks
+from .models import Recipe, TimelineEntry
+
+CHUNK_SIZE = 1000
+
+
+def is_celebrity(followers_count):
+    """Рецепты авторов с огромным числом подписчиков не рассылаются.
+
+    Подписчики получают их при чтении ленты прямо из таблицы рецептов.
+    """
+    return followers_count > settings.TIMELINE_FANOUT_LIMIT
+
+
+def trim(user_ids):
+    """Обрезает ленты до TIMELINE_SIZE последних рецептов.
+
+    Ленты проверяются одним запросом, а обрезаются только переросшие
+    лимит на десятую часть, чтобы не делать DELETE на каждую вставку.
+    """
+    size = settings.TIMELINE_SIZE
+    overgrown = TimelineEntry.objects.filter(
+        user_id__in=user_ids
+    ).values('user_id').annotate(
+        count=Count('id')
+    ).filter(count__gt=size + size // 10).values_list('user_id', flat=True)
+    for user_id in overgrown:
+        keep = TimelineEntry.objects.filter(user_id=user_id).order_by(
+            '-pub_date', '-recipe_id'
+        ).values('id')[:size]
+        TimelineEntry.objects.filter(user_id=user_id).exclude(
+            id__in=Subquery(keep)
+        ).delete()
+
+
+def fan_out(recipe_id):
+    """Разносит новый рецепт по лентам подписчиков автора."""
+    recipe = Recipe.objects.filter(pk=recipe_id).values(
+        'author_id', 'pub_date', 'author__followers_count'
+    ).first()
+    if recipe is None or is_celebrity(recipe['author__followers_count']):
+        return
+    followers = Follow.objects.filter(
+        author_id=recipe['author_id']
+    ).values_list('user_id', flat=True).iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        user_ids = list(islice(followers, CHUNK_SIZE))
+        if not user_ids:
+            break
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    pub_date=recipe['pub_date']
+                )
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True
+        )
+        trim(user_ids)
+
+
+def latest_recipes(author_ids):
+    return Recipe.objects.filter(
+        author_id__in=author_ids,
+        author__followers_count__lte=settings.TIMELINE_FANOUT_LIMIT
+    ).order_by('-pub_date', '-id').values_list(
+        'pk', 'pub_date'
+    )[:settings.TIMELINE_SIZE]
+
+
+def backfill(user_id, author_ids):
+    """Добавляет в ленту последние рецепты новых подписок."""
+    author_ids = Follow.objects.filter(
+        user_id=user_id,
+        author_id__in=author_ids
+    ).values_list('author_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+            for pk, pub_date in latest_recipes(list(author_ids))
+        ],
+        ignore_conflicts=True
+    )
+    trim([user_id])
+
+
+def follows_added(user_id, author_ids):
+    tasks.submit(backfill, user_id, list(author_ids))
+
+
+def follows_removed(user_id, author_ids):
+    TimelineEntry.objects.filter(
+        user_id=user_id,
+        recipe__author_id__in=author_ids
+    ).delete()
+
+
+def feed(user):
+    """Рецепты подписок: из ленты и напрямую у авторов-«знаменитостей»."""
+    followed = Follow.objects.filter(user=user).values('author_id')
+    celebrities = list(User.objects.filter(
+        pk__in=followed,
+        followers_count__gt=settings.TIMELINE_FANOUT_LIMIT
+    ).values_list('pk', flat=True))
+    condition = Q(pk__in=TimelineEntry.objects.filter(
+        user=user
+    ).values('recipe_id'))
+    if celebrities:
+        condition |= Q(author_id__in=celebrities)
+    return Recipe.objects.filter(condition)
+
+
+@transaction.atomic
+def rebuild():
+    """Собирает все ленты заново по подпискам и рецептам."""
+    TimelineEntry.objects.all().delete()
+    user_ids = Follow.objects.order_by('user_id').values_list(
+        'user_id', flat=True
+    ).distinct()
+    for user_id in user_ids.iterator():
+        author_ids = list(Follow.objects.filter(
+            user_id=user_id
+        ).values_list('author_id', flat=True))
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=user_id, recipe_id=pk, pub_date=pub_date)
+            for pk, pub_date in latest_recipes(author_ids)
+        ])
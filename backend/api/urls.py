@@ -2,7 +2,7 @@ from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
 from .views import (IngredientViewSet, ListSubscriptions, RecipeViewSet,
-                    Subscribe, TagViewSet)
+                    Subscribe, SubscribeBatch, TagViewSet)
 
 router = DefaultRouter()
 
@@ -13,6 +13,7 @@ router.register(r'ingredients', IngredientViewSet, basename='ingredients')
 urlpatterns = [
     path(r'users/subscriptions/', ListSubscriptions.as_view()),
     path('users/<int:pk>/subscribe/', Subscribe.as_view()),
+    path('users/subscribe/batch/', SubscribeBatch.as_view()),
     path('', include(router.urls)),
     path(r'', include('djoser.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
@@ -0,0 +1,57 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from users.models import Follow
+
+from .models import FavoriteRecipe, ShoppingCart
+
+
+def state_key(user_id):
+    return f'user_state:{user_id}'
+
+
+def load_state(user_id):
+    return {
+        'favorites': set(FavoriteRecipe.objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True)),
+        'cart': set(ShoppingCart.objects.filter(
+            user_id=user_id
+        ).values_list('recipe_id', flat=True)),
+        'follows': set(Follow.objects.filter(
+            user_id=user_id
+        ).values_list('author_id', flat=True)),
+    }
+
+
+def get_user_state(request):
+    """Избранное, список покупок и подписки текущего пользователя.
+
+    Множества id загружаются из кэша не чаще раза за запрос, а из базы -
+    раз в USER_STATE_TIMEOUT секунд или после сброса кэша.
+    """
+    state = getattr(request, '_user_state', None)
+    if state is None:
+        key = state_key(request.user.pk)
+        state = cache.get(key)
+        if state is None:
+            state = load_state(request.user.pk)
+            cache.set(key, state, settings.USER_STATE_TIMEOUT)
+        request._user_state = state
+    return state
+
+
+def update_user_state(request, kind, add=(), remove=()):
+    """Вносит изменение в состояние запроса и сбрасывает кэш.
+
+    Кэш не дописывается на месте: чтение и запись из разных процессов
+    затирали бы изменения друг друга. Следующий запрос перечитает
+    состояние из базы.
+    """
+    state = getattr(request, '_user_state', None)
+    if state is not None:
+        state[kind].update(add)
+        state[kind].difference_update(remove)
+    transaction.on_commit(partial(cache.delete, state_key(request.user.pk)))
@@ -1,53 +1,124 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import (OuterRef, Prefetch, Subquery,
+                              prefetch_related_objects)
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import etag
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, generics, status, viewsets
+from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from users.models import Follow, User
 
-from . import serializers
+from . import cart, serializers, timeline
+from .batch import add_batch, remove_batch
+from .cache import CachedResponseMixin
+from .cookable import cookable_index
+from .counters import bump
+from .exporters import EXPORTERS
 from .filters import Filter
-from .models import (FavoriteRecipe, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
-from .pagination import LimitPagination
+from .ingredient_index import ingredient_index
+from .models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                     ShoppingCartIngredient, Tag, recipe_related_lookups)
+from .pagination import LimitCursorPagination, LimitPagination
 from .permissions import IsAuthorOrAdminPermission
+from .recommendations import recommended_ids
+from .renderers import CSVRenderer, PlainTextRenderer
+from .user_state import update_user_state
+
+
+def insert_once(model, **fields):
+    """Создаёт связь одним INSERT под защитой уникального ограничения.
+
+    Возвращает False, если такая связь уже есть, в том числе когда её
+    только что создал параллельный запрос.
+    """
+    try:
+        with transaction.atomic():
+            model.objects.create(**fields)
+    except IntegrityError:
+        return False
+    return True
+
+
+def batch_response(request, model, field, kind, exclude=(), on_change=None):
+    """Пакетно добавляет или удаляет связи текущего пользователя."""
+    serializer = serializers.IdListSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    if request.method == 'POST':
+        outcomes, changed = add_batch(
+            request.user, model, field, ids, exclude, on_change
+        )
+        update_user_state(request, kind, add=changed)
+    else:
+        outcomes, changed = remove_batch(
+            request.user, model, field, ids, on_change
+        )
+        update_user_state(request, kind, remove=changed)
+    return Response({'results': outcomes}, status=status.HTTP_200_OK)
+
+
+def shopping_cart_etag(request, *args, **kwargs):
+    """ETag по составу списка покупок: ингредиенты и их количества."""
+    rows = ShoppingCartIngredient.objects.filter(
+        user=request.user
+    ).order_by('ingredient_id').values_list('ingredient_id', 'amount')
+    digest = hashlib.md5(request.accepted_renderer.format.encode())
+    for row in rows.iterator():
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """ Рецепты """
     queryset = Recipe.objects.all()
     pagination_class = LimitPagination
+    cursor_ordering = ('-pub_date', '-id')
+    permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = serializers.RecipePostSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = Filter
 
     def get_permissions(self):
-        if self.action in ('update', 'destroy'):
+        if self.action in ('update', 'partial_update', 'destroy'):
             permission_classes = [IsAuthorOrAdminPermission]
         else:
-            permission_classes = [IsAuthenticatedOrReadOnly]
+            permission_classes = self.permission_classes
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        return Recipe.objects.with_related()
+
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return serializers.RecipeGetSerializer
         return serializers.RecipePostSerializer
 
+    def get_read_data(self, recipe):
+        if getattr(recipe, '_prefetched_objects_cache', None):
+            recipe._prefetched_objects_cache = {}
+        prefetch_related_objects([recipe], *recipe_related_lookups())
+        return serializers.RecipeGetSerializer(
+            recipe,
+            context=self.get_serializer_context()
+        ).data
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
-        recipe = get_object_or_404(Recipe, pk=serializer.data.get('id'))
-        new_serializer = serializers.RecipeGetSerializer(
-            recipe,
-            context={'request': request}
+        return Response(
+            self.get_read_data(serializer.instance),
+            status=status.HTTP_201_CREATED
         )
-        return Response(new_serializer.data, status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
@@ -56,130 +127,222 @@ class RecipeViewSet(viewsets.ModelViewSet):
                                          partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
-        recipe = get_object_or_404(Recipe, pk=serializer.data.get('id'))
-        new_serializer = serializers.RecipeGetSerializer(
-            recipe,
-            context={'request': request},
-            partial=partial
+        return Response(
+            self.get_read_data(serializer.instance),
+            status=status.HTTP_200_OK
         )
-        return Response(new_serializer.data, status=status.HTTP_200_OK)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    def perform_update(self, serializer):
-        serializer.save(author=self.request.user)
-
     @action(
         detail=False,
         methods=['get'],
         permission_classes=(IsAuthenticated, ),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer),
     )
-    def download_shopping_cart(self, request):
-        ingredient_list = IngredientRecipe.objects.filter(
-            recipe__recipe_cart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(sum_amount=Sum('amount'))
-        shopping_list = ['Cписок покупок:\n']
-        shopping_list += '\n'.join([
-            f'{ingredient["ingredient__name"]}'
-            f'({ingredient["ingredient__measurement_unit"]}) - '
-            f'{ingredient["sum_amount"]}'
-            for ingredient in ingredient_list
-        ])
-        filename = 'shopping_cart.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+    @method_decorator(etag(shopping_cart_etag))
+    def download_shopping_cart(self, request, *args, **kwargs):
+        ingredient_list = cart.user_cart(request.user)
+        renderer = request.accepted_renderer
+        if renderer.format == 'json':
+            return Response(list(ingredient_list))
+        response = StreamingHttpResponse(
+            EXPORTERS[renderer.format](ingredient_list.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        filename = f'shopping_cart.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
+    @action(
+        detail=False,
+        methods=['get'],
+    )
+    def cookable(self, request):
+        values = []
+        for value in request.query_params.getlist('ingredients'):
+            values.extend(item for item in value.split(',') if item)
+        params = serializers.CookableSerializer(data={'ingredients': values})
+        params.is_valid(raise_exception=True)
+        ranked = cookable_index.rank(params.validated_data['ingredients'])
+        page = self.paginator.paginate_queryset(ranked, request)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        data = []
+        for recipe_id, coverage, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            item = self.get_serializer(recipe).data
+            item['coverage'] = round(coverage, 3)
+            item['missing_count'] = missing
+            data.append(item)
+        return self.paginator.get_paginated_response(data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=(IsAuthenticated,),
+        pagination_class=LimitCursorPagination,
+    )
+    def feed(self, request):
+        queryset = timeline.feed(request.user).with_related()
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+    )
+    def recommendations(self, request):
+        page = self.paginator.paginate_queryset(
+            recommended_ids(request), request
+        )
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in page if pk in recipes],
+            many=True
+        )
+        return self.paginator.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
     )
     def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        recipe_in_shopping_cart = ShoppingCart.objects.filter(
-            user=request.user,
-            recipe=recipe
-        )
-        if request.method == "POST":
-            if recipe_in_shopping_cart.exists():
-                return Response(
-                    "Этот рецепт уже есть в списке покупок",
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            else:
-                ShoppingCart.objects.create(user=request.user, recipe=recipe)
-                serializer = serializers.ShortRecipeSerializer(recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-        else:
-            if recipe_in_shopping_cart.exists():
-                recipe_in_shopping_cart.delete()
-                return Response(
-                    'Рецепт успешно удалён из списка покупок',
-                    status=status.HTTP_204_NO_CONTENT
-                )
-            else:
-                return Response(
-                    'Рецепт нельзя удалить, его нет в списке покупок',
-                    status.HTTP_400_BAD_REQUEST
-                )
+        if request.method == 'POST':
+            return self.add_relation(
+                request, pk, ShoppingCart, 'shopping_cart_count', 'cart',
+                'Этот рецепт уже есть в списке покупок',
+                on_change=cart.recipes_changed
+            )
+        return self.remove_relation(
+            request, pk, ShoppingCart, 'shopping_cart_count', 'cart',
+            'Рецепт успешно удалён из списка покупок',
+            'Рецепт нельзя удалить, его нет в списке покупок',
+            on_change=cart.recipes_changed
+        )
 
     @action(
         detail=True,
         methods=['post', 'delete'],
     )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        recipe_in_favorite = FavoriteRecipe.objects.filter(
-            user=request.user,
-            recipe=recipe
-        )
         if request.method == 'POST':
-            if recipe_in_favorite.exists():
-                return Response("Этот рецепт уже есть в избранном",
-                                status=status.HTTP_400_BAD_REQUEST)
-            else:
-                FavoriteRecipe.objects.create(user=request.user, recipe=recipe)
-                serializer = serializers.ShortRecipeSerializer(recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-        else:
-            if recipe_in_favorite.exists():
-                recipe_in_favorite.delete()
-                return Response('Рецепт успешно удалён из избранного',
-                                status.HTTP_204_NO_CONTENT)
-            else:
-                return Response(
-                    'Этот рецепт нельзя удалить, его нет в избранном',
-                    status.HTTP_400_BAD_REQUEST
-                )
-
-
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+            return self.add_relation(
+                request, pk, FavoriteRecipe, 'favorites_count', 'favorites',
+                'Этот рецепт уже есть в избранном'
+            )
+        return self.remove_relation(
+            request, pk, FavoriteRecipe, 'favorites_count', 'favorites',
+            'Рецепт успешно удалён из избранного',
+            'Этот рецепт нельзя удалить, его нет в избранном'
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart/batch',
+    )
+    def shopping_cart_batch(self, request):
+        return batch_response(
+            request, ShoppingCart, 'recipe', 'cart',
+            on_change=cart.recipes_changed
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite/batch',
+    )
+    def favorite_batch(self, request):
+        return batch_response(request, FavoriteRecipe, 'recipe', 'favorites')
+
+    def add_relation(self, request, pk, model, counter, kind,
+                     exists_message, on_change=None):
+        recipe = get_object_or_404(Recipe, pk=pk)
+        with transaction.atomic():
+            created = insert_once(model, user=request.user, recipe=recipe)
+            if created:
+                bump(Recipe.objects.filter(pk=recipe.pk), counter)
+                if on_change is not None:
+                    on_change(request.user.pk, [recipe.pk])
+        if not created:
+            return Response(exists_message, status=status.HTTP_400_BAD_REQUEST)
+        update_user_state(request, kind, add=[recipe.pk])
+        serializer = serializers.ShortRecipeSerializer(recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def remove_relation(self, request, pk, model, counter, kind,
+                        deleted_message, missing_message, on_change=None):
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=request.user,
+                recipe_id=pk
+            ).delete()
+            if deleted:
+                bump(Recipe.objects.filter(pk=pk), counter, -1)
+                if on_change is not None:
+                    on_change(request.user.pk, [pk])
+        if not deleted:
+            get_object_or_404(Recipe, pk=pk)
+            return Response(missing_message, status.HTTP_400_BAD_REQUEST)
+        update_user_state(request, kind, remove=[int(pk)])
+        return Response(deleted_message, status.HTTP_204_NO_CONTENT)
+
+
+class TagViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """Тэги"""
+    cache_group = 'tags'
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializers
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """Ингредиенты"""
+    cache_group = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
-    filter_backends = (filters.SearchFilter, )
-    search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            self.search_index, request, *args, **kwargs
+        )
+
+    def search_index(self, request, *args, **kwargs):
+        return Response(
+            ingredient_index.search(request.query_params.get('name', ''))
+        )
+
 
 class ListSubscriptions(generics.ListAPIView):
-    """Список покупок"""
+    """Список подписок"""
     serializer_class = serializers.SubscriptionsSerializer
     permission_classes = (IsAuthenticated,)
+    pagination_class = LimitPagination
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
-        return Follow.objects.filter(user=self.request.user)
+        recipes = Recipe.objects.all()
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit and recipes_limit.isdigit():
+            # Первые N рецептов каждого автора одним запросом на страницу.
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:int(recipes_limit)]
+            ))
+        return Follow.objects.filter(
+            user=self.request.user
+        ).select_related('author').prefetch_related(
+            Prefetch('author__author', queryset=recipes,
+                     to_attr='recent_recipes')
+        ).order_by('id')
 
 
 class Subscribe(APIView):
@@ -190,34 +353,59 @@ class Subscribe(APIView):
 
     def post(self, request, pk):
         author = get_object_or_404(User, pk=pk)
-        is_subscribed = Follow.objects.filter(user=request.user, author=author)
         if author == request.user:
             return Response("Нельзя подписаться на самого себя",
                             status=status.HTTP_400_BAD_REQUEST)
-        elif is_subscribed.exists():
+        with transaction.atomic():
+            created = insert_once(Follow, user=request.user, author=author)
+            if created:
+                bump(User.objects.filter(pk=author.pk), 'followers_count')
+                timeline.follows_added(request.user.pk, [author.pk])
+        if not created:
             return Response(
                 "Вы уже подписались на этого автора.",
                 status=status.HTTP_400_BAD_REQUEST
             )
-        else:
-            Follow.objects.create(user=request.user, author=author)
-            serializer = serializers.IsSubscribeSerializer(
-                author,
-                context={'request': 'request'}
-            )
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        update_user_state(request, 'follows', add=[author.pk])
+        serializer = serializers.IsSubscribeSerializer(
+            author,
+            context={'request': request}
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, pk):
-        author = get_object_or_404(User, pk=pk)
-        subscription = Follow.objects.filter(user=request.user, author=author)
-        if subscription.exists():
-            subscription.delete()
-            return Response(
-                'Вы успешно отписались от этого автора!',
-                status=status.HTTP_204_NO_CONTENT
-            )
-        else:
+        with transaction.atomic():
+            deleted, _ = Follow.objects.filter(
+                user=request.user,
+                author_id=pk
+            ).delete()
+            if deleted:
+                bump(User.objects.filter(pk=pk), 'followers_count', -1)
+                timeline.follows_removed(request.user.pk, [pk])
+        if not deleted:
+            get_object_or_404(User, pk=pk)
             return Response(
                 'Вы ещё не подписаны на этого автора.',
                 status.HTTP_400_BAD_REQUEST
             )
+        update_user_state(request, 'follows', remove=[pk])
+        return Response(
+            'Вы успешно отписались от этого автора!',
+            status=status.HTTP_204_NO_CONTENT
+        )
+
+
+class SubscribeBatch(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        return batch_response(
+            request, Follow, 'author', 'follows', exclude={request.user.pk},
+            on_change=timeline.follows_added
+        )
+
+    def delete(self, request):
+        return batch_response(
+            request, Follow, 'author', 'follows',
+            on_change=timeline.follows_removed
+        )
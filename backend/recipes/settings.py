@@ -65,7 +65,22 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default="postgres"),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default="postgres"),
         'HOST': os.getenv('DB_HOST', default="db"),
-        'PORT': os.getenv('DB_PORT', default="5432")
+        'PORT': os.getenv('DB_PORT', default="5432"),
+        # Для SQLite без имени тестовая база живёт в памяти.
+        'TEST': {'NAME': os.getenv('DB_TEST_NAME')},
+    }
+}
+
+# Кэш должен быть общим для всех процессов сервера и служебных команд:
+# через него расходятся версии групп данных (bump_version) и журнал
+# изменений индекса рецептов. LocMemCache у каждого процесса свой.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=10000)),
+        },
     }
 }
 
@@ -109,6 +124,22 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 AUTH_USER_MODEL = 'users.User'
 
+USER_STATE_TIMEOUT = int(os.getenv('USER_STATE_TIMEOUT', default=300))
+
+# Индексы в памяти процесса перестраиваются не реже чем раз в столько
+# секунд, даже если изменение версии в кэше до них не дошло.
+INDEX_MAX_AGE = int(os.getenv('INDEX_MAX_AGE', default=300))
+
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', default=2))
+
+BATCH_MAX_IDS = int(os.getenv('BATCH_MAX_IDS', default=100))
+
+RECOMMENDATIONS_TIMEOUT = int(os.getenv('RECOMMENDATIONS_TIMEOUT', default=600))
+
+TIMELINE_SIZE = int(os.getenv('TIMELINE_SIZE', default=500))
+
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', default=10000))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -122,10 +153,13 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
 
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CachedCountLimitOffsetPagination',
     'PAGE_SIZE': 6,
 }
 
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', default=30))
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100000))
+
 DJOSER = {
     'HIDE_USERS': False,
     'LOGIN_FIELD': 'email',
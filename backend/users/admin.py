@@ -1,12 +1,51 @@
+from functools import partial
+
+from api import timeline
+from api.counters import recount
+from api.user_state import state_key
 from django.contrib import admin
+from django.core.cache import cache
+from django.db import transaction
 
 from .models import Follow, User
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('first_name', 'last_name', 'username', 'email')
+    list_display = ('first_name', 'last_name', 'username', 'email',
+                    'recipes_count', 'followers_count')
     list_filter = ('email', 'first_name', 'last_name')
+    readonly_fields = ('recipes_count', 'followers_count')
+
+
+@admin.register(Follow)
+class FollowAdmin(admin.ModelAdmin):
+    """Подписки: только просмотр и удаление.
+
+    Удаление пересчитывает число подписчиков, чистит ленту и сбрасывает
+    кэш пользователя, как отписка через API.
+    """
+    list_display = ('user', 'author')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Follow.objects.filter(pk=obj.pk))
 
-admin.site.register(Follow)
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        removed = {}
+        for user_id, author_id in queryset.values_list('user', 'author'):
+            removed.setdefault(user_id, []).append(author_id)
+        queryset.delete()
+        recount(User, 'followers_count', Follow, 'author', pks={
+            author_id for author_ids in removed.values()
+            for author_id in author_ids
+        })
+        for user_id, author_ids in removed.items():
+            timeline.follows_removed(user_id, author_ids)
+            transaction.on_commit(partial(cache.delete, state_key(user_id)))
@@ -29,6 +29,14 @@ class User(AbstractUser):
         default=False,
         verbose_name="Подписка"
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество рецептов",
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество подписчиков",
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name", "password"]
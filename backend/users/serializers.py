@@ -1,8 +1,9 @@
 from api.models import Recipe
+from api.user_state import get_user_state
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 
-from .models import Follow, User
+from .models import User
 
 
 class CurrentUserSerializer(UserSerializer):
@@ -18,8 +19,7 @@ class CurrentUserSerializer(UserSerializer):
         request = self.context.get("request")
         if not request.user.is_authenticated:
             return False
-        return Follow.objects.filter(user=request.user,
-                                     author=obj).exists()
+        return obj.id in get_user_state(request)['follows']
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
@@ -30,7 +30,7 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
 
 class SubscriptionsSerializer(CurrentUserSerializer):
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -41,7 +41,3 @@ class SubscriptionsSerializer(CurrentUserSerializer):
         recipes = Recipe.objects.filter(author=obj)
         serializer = ShortRecipeSerializer(recipes, many=True)
         return serializer.data
-
-    def get_recipes_count(self, obj):
-        recipes = Recipe.objects.filter(author=obj)
-        return recipes.count()